@@ -1,15 +1,32 @@
+import time
+
+# Start timing the rerun first, so the timing covers the whole script
+rerun_start_time = time.perf_counter()
+
 from openai import OpenAI
 import streamlit as st
-import time
-import ast
 from pinecone import Pinecone
 import json
-import requests
+import itertools
+import statistics
+from collections.abc import Iterator
+from utils.embedding_cache import EmbeddingCache
+from utils.downloads import DownloadManager
+from utils.uploads import UploadRegistry
+from utils.vector_store import LocalIndex
+from utils.records import RecordStore
 from settings import (
     OPENAI_API_KEY,
     PINECONE_API_KEY,
     PINECONE_INDEX,
     PINECONE_ENVIRONMENT,
+    VECTOR_BACKEND,
+    LOCAL_INDEX_PATH,
+    RECORD_CACHE_SIZE,
+    RECORD_CACHE_TTL,
+    RESPONSE_WORD_DELAY,
+    RESPONSE_LINE_DELAY,
+    SHOW_RERUN_TIME,
     EMBEDDING_MODEL,
     LLM_MODEL,
     REGIONS,
@@ -25,23 +42,61 @@ st.title("AgriFood Data Lab")
 st.subheader("Discover agricultural learning, use case, and dataset resources, with AI-enabled search, retrieval, and analysis capabilities.")
 st.markdown("---")
 
-# Initialize OpenAI and Pinecone clients
-client = OpenAI(api_key=OPENAI_API_KEY)
-pc = Pinecone(
-    api_key=PINECONE_API_KEY, 
-    environment=PINECONE_ENVIRONMENT,
-)
+# Initialize the OpenAI client once per server process (it only connects when the first request is made)
+@st.cache_resource
+def get_openai_client():
+    return OpenAI(api_key=OPENAI_API_KEY)
+client = get_openai_client()
+
+# Initialize the Pinecone client once per server process
+@st.cache_resource
+def get_pinecone_client():
+    return Pinecone(
+        api_key=PINECONE_API_KEY, 
+        environment=PINECONE_ENVIRONMENT,
+    )
 
-# Connect to Pinecone index
-index = pc.Index(PINECONE_INDEX)
+# Connect to the Pinecone index, or load the local index once per server process (on first use, so reruns that do not search never wait for it)
+@st.cache_resource
+def get_index():
+    if VECTOR_BACKEND == "local":
+        return LocalIndex(LOCAL_INDEX_PATH)
+    return get_pinecone_client().Index(PINECONE_INDEX)
 
-# Load the AgriFood Data Lab logo and its black version 
-image_path = "images/logo.png"
-with open(image_path, "rb") as file:
-    img_bytes = file.read()
-image_path_black = "images/logo_black.png"
-with open(image_path_black, "rb") as file:
-    img_bytes_black = file.read()
+# Initialize the cache of parsed record metadata once per server process (on first use, like the index)
+@st.cache_resource
+def get_record_store():
+    return RecordStore(get_index(), maxsize=RECORD_CACHE_SIZE, ttl=RECORD_CACHE_TTL)
+
+# Initialize the embedding cache (shared with the data pipelines) once per server process
+@st.cache_resource
+def get_embedding_cache():
+    return EmbeddingCache()
+embedding_cache = get_embedding_cache()
+
+# Initialize the download manager (its file cache is shared with the data pipelines) once per server process
+@st.cache_resource
+def get_download_manager():
+    return DownloadManager()
+download_manager = get_download_manager()
+
+# Initialize the registry of uploaded files (shared with the data pipelines) once per server process
+@st.cache_resource
+def get_upload_registry():
+    return UploadRegistry(client)
+upload_registry = get_upload_registry()
+
+# Load the AgriFood Data Lab logo and its black version once per server process
+@st.cache_resource
+def get_logos():
+    image_path = "images/logo.png"
+    with open(image_path, "rb") as file:
+        img_bytes = file.read()
+    image_path_black = "images/logo_black.png"
+    with open(image_path_black, "rb") as file:
+        img_bytes_black = file.read()
+    return img_bytes, img_bytes_black
+img_bytes, img_bytes_black = get_logos()
     
 # Set up Streamlit button persistence
 # https://docs.streamlit.io/library/advanced-features/button-behavior-and-examples
@@ -50,10 +105,14 @@ if 'clicked' not in st.session_state:
 def click_button():
     st.session_state.clicked = True
 
-# Define function to call Embedding API and return embedding
+# Define function to call Embedding API (through the embedding cache) and return embedding
 def get_embedding(text, model=EMBEDDING_MODEL):
     try:
-        return client.embeddings.create(input=[text], model=model).data[0].embedding
+        return embedding_cache.embed(
+            [text],
+            model,
+            lambda texts: [data.embedding for data in client.embeddings.create(input=texts, model=model).data]
+        )[0]
     except Exception as e:
         st.error(f"Failed to get embedding: {e}")
         # Optionally, log the error for debugging purposes
@@ -63,39 +122,51 @@ def get_embedding(text, model=EMBEDDING_MODEL):
 # Function to download file and upload to OpenAI assistant
 def download_file_upload_to_assistant(id):
     
-    # Get the file URL from Pinecone
-    file = index.fetch([id])
-    url = file.vectors[id].metadata["url"]
+    # Get the file URL from the record store
+    url = get_record_store().get(id)["url"]
     
-    # Download the file
+    # Download the file (served from the local download cache if it was downloaded before)
     with st.spinner(text="Downloading file..."):
         try:
-            response = requests.get(url)
-            with open('downloaded_file.pdf', 'wb') as file:
-                file.write(response.content)
+            download_manager.fetch(url)
         except Exception as e:
             print("Error:", e)
+            return
 
-    # Upload the file to OpenAI
+    # Upload the file to OpenAI (unless the same document was uploaded before), from a copy of its own so concurrent sessions do not overwrite each other's file
     with st.spinner(text="Uploading file..."):
         try:
-            client.files.create(
-                file=open('downloaded_file.pdf', "rb"),
-                purpose='assistants'
-            )
+            with download_manager.download(url) as file_path:
+                upload_registry.upload(file_path)
         except Exception as e:
             print("Error:", e)
 
 # Define function to generate streamed text response from string
 # https://docs.streamlit.io/knowledge-base/tutorials/build-conversational-apps
-def response_generator(text):
-    for segment in text.split('\n'):
-        print(segment)
-        for word in segment.split():
+def response_generator(text, word_delay=RESPONSE_WORD_DELAY, line_delay=RESPONSE_LINE_DELAY):
+    segments = [(segment.split(), '  \n') for segment in text.split('\n')]
+    # Flush the whole string at once unless pacing is configured
+    if not word_delay and not line_delay:
+        yield ''.join(''.join(word + " " for word in words) + line_break for words, line_break in segments)
+        return
+    for words, line_break in segments:
+        for word in words:
             yield word + " "
-            time.sleep(0.075)
-        yield '  \n'
-        time.sleep(0.05)
+            time.sleep(word_delay)
+        yield line_break
+        time.sleep(line_delay)
+
+# Define function to generate streamed text response from a Chat Completion stream, token by token
+def stream_generator(stream):
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+# Define function to generate streamed text response from a text stream or a string
+def reply_generator(reply):
+    if isinstance(reply, Iterator):
+        return reply
+    return response_generator(str(reply))
 
 # Define function to preselect search filters based on the message history
 def preselect_search_filters(type=[], year=[], country=[], region=[], organization=[], topic=[]):
@@ -147,54 +218,62 @@ def search_knowledge_base(query, type, year, country, region, organization, topi
     embedding = get_embedding(query)
     # generate the filter dictionary
     filter_dict = {}
-    if type is not []:
+    if type:
         filter_dict["type"] = {"$in": type}
-    if year is not []:
+    if year:
         filter_dict["year"] = {"$in": year}
-    if country is not []:
+    if country:
         filter_dict["country"] = {"$in": country}
-    if region is not []:
+    if region:
         filter_dict["region"] = {"$in": region}
-    if organization is not []:
+    if organization:
         filter_dict["organization"] = {"$in": organization}
-    if topic is not []:
+    if topic:
         filter_dict["topic"] = {"$in": topic}
-    # Query the knowledge base index
+    # Query the knowledge base index, restricted to the records matching the selected filters
     try:
-        top_k_matches = index.query(
+        top_k_matches = get_index().query(
             top_k=5,
             include_metadata=True,
             include_values=False,
-            vector=embedding
+            vector=embedding,
+            filter=filter_dict or None
         )
     except Exception as e:
         st.error("Failed to query the Pinecone index. Please try again later.")
         print(f"Error querying Pinecone index: {e}")
         return {"matches": []}
+    # Warm the record store with the metadata of the top k matches, so follow-up questions are served from memory
+    # (a failure only costs a fetch later, so it never fails the search)
+    try:
+        get_record_store().add_many({match['id']: match['metadata'] for match in top_k_matches['matches']})
+    except Exception as e:
+        print(f"Error warming the record store: {e}")
     # Extract the right metadata from the top k matches
     match_string = "We used the conversation and selected filters to run an AI-enabled semantic search on our database. Here are the top matches:"
     for match in top_k_matches['matches']:
         metadata = match['metadata']
-        match_string += f"  \n  \n**{metadata['title']} in {metadata['country']}:**  {metadata['description'][:metadata['description'].find('.')+1]} (ID: {match['id']})  \n  \n"
+        # Only use cases have a country, so name it only when the record has one
+        location = f" in {metadata['country']}" if metadata.get('country') else ""
+        description = metadata.get('description', '')
+        match_string += f"  \n  \n**{metadata.get('title', '')}{location}:**  {description[:description.find('.')+1]} (ID: {match['id']})  \n  \n"
     match_string += "Would you like to know more about any of these matches or search for something else?"
     # Return the top k matches
     return match_string
 
 # Define function to get more information on a record from the knowledge base using its id
 def get_more_information(id):
-    # Get the metadata of the record from the knowledge base
-    key = list(index.fetch(ids=[id])['vectors'])[0]
-    metadata = index.fetch(ids=[id])['vectors'][key]['metadata']
+    # Get the parsed metadata of the record from the record store
+    metadata = get_record_store().get(id)
+    if metadata is None:
+        return f"We couldn't find a record with ID {id} in our database. Would you like to know more about another record or search for something else?"
     # Format metadata into markdown string
-    documents = {}
-    for doc in metadata['document']:
-        doc = ast.literal_eval('{' + doc + '}')
-        documents.update(doc)
     documents_string = ""
-    for key, value in documents.items():
+    for key, value in metadata['documents'].items():
         documents_string += f" - [{key}]({value})  \n"
     # convert list of strings into comma-seperated string
-    markdown_string = f"Here's all of the information we have on that record in our database:  \n  \n**Title:** {metadata['title']}  \n **Description:** {metadata['description']}  \n **Type:** use case  \n **Project:** {metadata['project']}  \n **Organization:** {metadata['organization']}  \n **Region:** {metadata['region']}  \n **Country:** {metadata['country']}  \n**Document(s):** {documents_string}  \n **Topic(s):** {', '.join(metadata['topic'])}  \n **Year(s):** {', '.join(metadata['year'])}  \n **Contact(s):** {', '.join(metadata['contact'])}  \n **Project ID:** {metadata['project_id']}  \n  \nWould you like use to analyze any of the linked files or search for something else?"
+    # Datasets and learning materials lack some of the use case fields, so missing fields are left empty
+    markdown_string = f"Here's all of the information we have on that record in our database:  \n  \n**Title:** {metadata.get('title', '')}  \n **Description:** {metadata.get('description', '')}  \n **Type:** {metadata.get('type', 'use case')}  \n **Project:** {metadata.get('project', '')}  \n **Organization:** {metadata.get('organization', '')}  \n **Region:** {metadata.get('region', '')}  \n **Country:** {metadata.get('country', '')}  \n**Document(s):** {documents_string}  \n **Topic(s):** {', '.join(metadata.get('topic', []))}  \n **Year(s):** {', '.join(metadata.get('year', []))}  \n **Contact(s):** {', '.join(metadata.get('contact', []))}  \n **Project ID:** {metadata.get('project_id', '')}  \n  \nWould you like use to analyze any of the linked files or search for something else?"
     return markdown_string
 
 functions = {
@@ -202,11 +281,9 @@ functions = {
     "get_more_information": get_more_information
 }
 
-# Define function to execute function call and return results
-def call_tool(tool_call, functions):
-    # Extract the function name and arguments from the message
-    function_name = tool_call.function.name
-    function_args = json.loads(tool_call.function.arguments)
+# Define function to call a function by name with JSON-encoded arguments and return results
+def call_function(function_name, function_arguments, functions):
+    function_args = json.loads(function_arguments or "{}")
     # Check if the function exists
     if function_name in functions:
         # Call the function with the provided arguments
@@ -215,155 +292,171 @@ def call_tool(tool_call, functions):
         results = f"Error: function {function_name} does not exist"
     return results
 
-# Define function to call Chat Completion API with function and return response
-def chat_completion_with_function(messages, tools, tool_choice, model, functions):
-    # Try to call Chat Completion API to generate response
+# Define function to call Chat Completion API with function as a stream, and return either a text stream or the function results
+def chat_completion_with_function_stream(messages, tools, tool_choice, model, functions):
+    # Try to call Chat Completion API to generate a streamed response
     try:
-        response = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model=model,
             messages=messages,
             tools=tools,
             tool_choice=tool_choice,
+            stream=True,
         )
     except Exception as e:
         print("Unable to generate Chat Completion response")
         print(f"Exception: {e}")
         return e
-    # Extract the response message
-    tool_calls = response.choices[0].message.tool_calls
-    # Check if the response message requires a function call
-    if tool_calls == []:
-        print(f"Tool not required, responding to user")
-        return response
-    else:
-        print(f"Tool requested, calling function")
-        # Extract the function name and arguments from the message
-        function_name = tool_calls[0].function.name
-        function_args = json.loads(tool_calls[0].function.arguments)
-        # Check if the function exists
-        if function_name in functions:
-            # Call the function with the provided arguments
-            results = functions[function_name](**function_args)
-        else:
-            results = f"Error: function {function_name} does not exist"
-        return results
+    # Assemble the first tool call from the streamed deltas
+    tool_call = None
+    tool_call_complete = False
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        # If the response is free text, return the rest of the stream (starting with the tokens already read)
+        if delta.content and tool_call is None:
+            print(f"Tool not required, responding to user")
+            return itertools.chain([delta.content], stream_generator(stream))
+        for tool_call_delta in delta.tool_calls or []:
+            # Only the first tool call is executed, so it is complete as soon as the next one starts
+            if tool_call is not None and tool_call_delta.index != tool_call["index"]:
+                tool_call_complete = True
+                break
+            if tool_call is None:
+                tool_call = {"index": tool_call_delta.index, "name": "", "arguments": ""}
+            if tool_call_delta.function and tool_call_delta.function.name:
+                tool_call["name"] += tool_call_delta.function.name
+            if tool_call_delta.function and tool_call_delta.function.arguments:
+                tool_call["arguments"] += tool_call_delta.function.arguments
+        if tool_call_complete or chunk.choices[0].finish_reason is not None:
+            break
+    # Stop reading the stream and call the function as soon as the tool call is complete
+    stream.close()
+    if tool_call is None:
+        return ""
+    print(f"Tool requested, calling function")
+    return call_function(tool_call["name"], tool_call["arguments"], functions)
 
-# Define the tools to be used in the conversation
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "preselect_search_filters",
-            "description": "Preselect search filters based on the message history.",
-            "parameters": {
-                "type": 
-                    "object",
-                "properties": {
-                    "type": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
-                        },
-                        "description": f"""
-                            Resource type(s). Options include:
-                            {TYPES}
-                        """
-                    },
-                    "year": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
+# Define the tools to be used in the conversation (built once per server process)
+@st.cache_resource
+def get_tools():
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": "preselect_search_filters",
+                "description": "Preselect search filters based on the message history.",
+                "parameters": {
+                    "type": 
+                        "object",
+                    "properties": {
+                        "type": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                Resource type(s). Options include:
+                                {TYPES}
+                            """
                         },
-                        "description": f"""
-                            The year(s) that the learning/use case/dataset covers. Options include:
-                            {YEARS}
-                        """
-                    },
-                    "country": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
+                        "year": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                The year(s) that the learning/use case/dataset covers. Options include:
+                                {YEARS}
+                            """
                         },
-                        "description": f"""
-                            The country(s) involved. Options include:
-                            {COUNTRIES}
-                        """
-                    },
-                    "region": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
+                        "country": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                The country(s) involved. Options include:
+                                {COUNTRIES}
+                            """
                         },
-                        "description": f"""
-                            The region(s) involved. Options include:
-                            {REGIONS}
-                        """
-                    },
-                    "organization": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
+                        "region": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                The region(s) involved. Options include:
+                                {REGIONS}
+                            """
                         },
-                        "description": f"""
-                            The organization(s) involved. Options include:
-                            {ORGANIZATIONS}
-                        """
-                    },
-                    "topic": {
-                        "type": "array",
-                        "items": {
-                            "type": "string"
+                        "organization": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                The organization(s) involved. Options include:
+                                {ORGANIZATIONS}
+                            """
                         },
-                        "description": f"""
-                            The agricultural topic(s) involved. Options include:
-                            {TOPICS}
-                        """
+                        "topic": {
+                            "type": "array",
+                            "items": {
+                                "type": "string"
+                            },
+                            "description": f"""
+                                The agricultural topic(s) involved. Options include:
+                                {TOPICS}
+                            """
+                        }
                     }
                 }
             }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_more_information",
-            "description": "Get more information on a record from the knowledge base using its id.",
-            "parameters": {
-                "type": 
-                    "object",
-                "properties": {
-                    "id": {
-                        "type": "string",
-                        "description": "The id of the record to retrieve."
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "get_more_information",
+                "description": "Get more information on a record from the knowledge base using its id.",
+                "parameters": {
+                    "type": 
+                        "object",
+                    "properties": {
+                        "id": {
+                            "type": "string",
+                            "description": "The id of the record to retrieve."
+                        },
                     },
-                },
-                "required": [
-                    "id"
-                ]
+                    "required": [
+                        "id"
+                    ]
+                }
             }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "download_file_upload_to_assistant",
-            "description": "Download a file and upload it to the assistant for retrieval or code interpreter.",
-            "parameters": {
-                "type": 
-                    "object",
-                "properties": {
-                    "id": {
-                        "type": "string",
-                        "description": "The id of the file to download."
-                    }
-                },
-                "required": [
-                    "id"
-                ]
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "download_file_upload_to_assistant",
+                "description": "Download a file and upload it to the assistant for retrieval or code interpreter.",
+                "parameters": {
+                    "type": 
+                        "object",
+                    "properties": {
+                        "id": {
+                            "type": "string",
+                            "description": "The id of the file to download."
+                        }
+                    },
+                    "required": [
+                        "id"
+                    ]
+                }
             }
         }
-    }
-]
+    ]
+tools = get_tools()
 
 # Define the tools to be used by the assistant in the conversation
 assistant_tools = [
@@ -403,37 +496,38 @@ elif "messages" in st.session_state:
                 st.write(message["content"])
             # Redisplay the filters if the assistant message is about preselecting search filters
             if message["content"] == "Thank you. We've added some optional filters that you can edit to help us narrow down your search.":
+                # Keep the user's edits to the filters in the session state, so they are applied to the search
                 with st.chat_message(name="user", avatar=img_bytes_black):
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.multiselect(
+                        st.session_state.type = st.multiselect(
                             'Type(s)',
                             TYPES,
                             st.session_state.type
                         )                
-                        st.multiselect(
+                        st.session_state.year = st.multiselect(
                             'Year(s)',
                             YEARS,
                             st.session_state.year
                         )
                     with col2:
-                        st.multiselect(
+                        st.session_state.country = st.multiselect(
                             'Country(s)',
                             COUNTRIES,
                             st.session_state.country
                         )
-                        st.multiselect(
+                        st.session_state.region = st.multiselect(
                             'Region(s)',
                             REGIONS,
                             st.session_state.region
                         )
                     with col3:
-                        st.multiselect(
+                        st.session_state.organization = st.multiselect(
                             'Organization(s)',
                             ORGANIZATIONS,
                             st.session_state.organization
                         )
-                        st.multiselect(
+                        st.session_state.topic = st.multiselect(
                             'Topic(s)',
                             TOPICS,
                             st.session_state.topic
@@ -463,7 +557,7 @@ if len(st.session_state.messages) == 2 and st.session_state.messages[-2]["conten
     )
     # Display the assistant message (with streaming effect)
     with st.chat_message("assistant", avatar=img_bytes):
-            st.write(
+            st.write_stream(
                 response_generator(
                     "Could you describe what you're looking for to us in more detail?"
                 )
@@ -493,15 +587,20 @@ elif len(st.session_state.messages) == 4 and st.session_state.messages[-2]["cont
                     "role": "system", 
                     "content": "Use the conversation to call the preselect function."
                 })
-            # Call the Chat Completion with function function
-            response = chat_completion_with_function(
+            # Call the Chat Completion with function function (streamed, so the filters are shown as soon as the tool call is complete)
+            # The preselect function is required, since the next steps need the filters and have no place for a text reply
+            response = chat_completion_with_function_stream(
                 st.session_state.messages, 
                 tools=tools, 
-                tool_choice='auto', 
+                tool_choice={"type": "function", "function": {"name": "preselect_search_filters"}}, 
                 model=LLM_MODEL,
                 functions=functions)
             # Remove the system prompt from the chat history
             st.session_state.messages.pop(0)
+            # preselect_search_filters returns None, so any other response means no filters were preselected (e.g. the request failed)
+            # Show empty filters instead, so the search and the next reruns always have them
+            if response is not None:
+                preselect_search_filters()
             # Add a (persistent) search button that triggers the assistant response
             st.button("Search", on_click=click_button)
 
@@ -509,16 +608,16 @@ elif len(st.session_state.messages) == 4 and st.session_state.messages[-2]["cont
 elif len(st.session_state.messages) == 5 and st.session_state.clicked and st.session_state.messages[-3]["content"] == "Could you describe what you're looking for to us in more detail?":
     # Add the assistant message to the chat history
     with st.chat_message("assistant", avatar=img_bytes):
-        # Search the knowledge base using the query and selected filters (currently not using the filters, only the query)
+        # Search the knowledge base using the query and selected filters
         with st.spinner("Searching database..."):           
             match_string = search_knowledge_base(
                 query=st.session_state.messages[-2]["content"],
-                type=[],
-                year=[],
-                country=[],
-                region=[],
-                organization=[],
-                topic=[]
+                type=st.session_state.get("type", []),
+                year=st.session_state.get("year", []),
+                country=st.session_state.get("country", []),
+                region=st.session_state.get("region", []),
+                organization=st.session_state.get("organization", []),
+                topic=st.session_state.get("topic", [])
             )
         # Display the matches (with streaming effect)    
         st.write_stream(
@@ -541,8 +640,8 @@ if len(st.session_state.messages) > 6 and st.session_state.messages[-2]["content
         "role": "system", 
         "content": "Use the conversation to call the get_more_information function."
     })
-    # Call Chat Completion with function function
-    response = chat_completion_with_function(
+    # Call Chat Completion with function function (streamed, so text replies are shown token by token)
+    response = chat_completion_with_function_stream(
         st.session_state.messages, 
         tools=tools, 
         tool_choice='auto', 
@@ -550,20 +649,20 @@ if len(st.session_state.messages) > 6 and st.session_state.messages[-2]["content
         functions=functions)
     # Remove the system prompt from the chat history
     st.session_state.messages.pop(0)
-    # Add the assistant message to the chat history
+    # Display the assistant message (streamed as it is generated)
+    with st.chat_message("assistant", avatar=img_bytes):
+        content = st.write_stream(
+            reply_generator(
+                response
+            )
+        )
+    # Add the assistant message to the chat history (function results as returned, since the next step checks how they end, and streamed replies as displayed)
     st.session_state.messages.append(
         {
             "role": "assistant", 
-            "content": response
+            "content": response if isinstance(response, str) else content
         }
     )
-    # Display the assistant message (with streaming effect)
-    with st.chat_message("assistant", avatar=img_bytes):
-        st.write(
-            response_generator(
-                response
-            )
-        )
 
 # If the last message ends with the assistant asking for more details, call the get_more_information function
 if len(st.session_state.messages) > 8 and st.session_state.messages[-2]["content"].endswith("else?"):
@@ -586,4 +685,11 @@ if len(st.session_state.messages) > 8 and st.session_state.messages[-2]["content
             response_generator(
                 response
             )
-        )  
\ No newline at end of file
+        )  
+
+# Time the rerun, keeping the last 100 timings in the session state, and show it when SHOW_RERUN_TIME is set
+rerun_time = time.perf_counter() - rerun_start_time
+st.session_state.rerun_times = st.session_state.get("rerun_times", [])[-99:] + [rerun_time]
+if SHOW_RERUN_TIME:
+    print(f"Rerun took {rerun_time * 1000:.1f} ms")
+    st.caption(f"Rerun took {rerun_time * 1000:.1f} ms (median of the last {len(st.session_state.rerun_times)} reruns: {statistics.median(st.session_state.rerun_times) * 1000:.1f} ms)")
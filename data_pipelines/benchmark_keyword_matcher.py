@@ -0,0 +1,43 @@
+### BENCHMARK THE COMPILED KEYWORD MATCHER AGAINST THE PER-KEYWORD SUBSTRING SEARCH ###
+
+import os
+import csv
+import time
+from dataset_catalog import KEYWORDS, is_related_to_food_or_agriculture, match_keywords, iter_json_array
+
+# Previous implementation, searching the description once per keyword
+def is_related_to_food_or_agriculture_loop(description):
+    if description is None:
+        return False
+
+    description_lower = description.lower()
+    for keyword in KEYWORDS:
+        if keyword in description_lower:
+            return True
+
+    return False
+
+# Function to time a filter over all texts, keeping the best of several repeats
+def benchmark(function, texts, repeats=5):
+    best_time = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        results = [function(text) for text in texts]
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time, results
+
+# Use the catalog names and the descriptions of the datasets already crawled as sample texts
+dirname = os.getcwd()
+texts = [dataset.get('name') for dataset in iter_json_array(os.path.join(dirname, 'data/wb_datasets.json'))]
+with open(os.path.join(dirname, 'data/wb_ag_datasets.csv'), mode='r', encoding='utf-8') as file:
+    texts += [entry['description'] for entry in csv.DictReader(file)]
+
+loop_time, loop_results = benchmark(is_related_to_food_or_agriculture_loop, texts)
+pattern_time, pattern_results = benchmark(is_related_to_food_or_agriculture, texts)
+count_time, count_results = benchmark(match_keywords, texts)
+
+assert loop_results == pattern_results == [bool(keywords) for keywords in count_results], "The compiled matcher disagrees with the substring search"
+print(f"{len(texts)} texts, {sum(pattern_results)} related to food or agriculture")
+print(f"Substring search: {loop_time * 1000:.1f} ms")
+print(f"Compiled matcher: {pattern_time * 1000:.1f} ms ({loop_time / pattern_time:.1f}x faster)")
+print(f"Keyword counts:   {count_time * 1000:.1f} ms")
@@ -0,0 +1,114 @@
+### FILTERING OF THE WORLD BANK DATASET CATALOG ###
+
+import re
+import json
+from collections import Counter
+
+# Keywords marking a dataset as related to food or agriculture
+KEYWORDS = {
+    'food', 'agriculture', 'farming', 'crops', 'livestock', 'harvest',
+    'horticulture', 'irrigation', 'fertilizer', 'farm', 'ranch', 'grain',
+    'vegetable', 'fruit', 'meat', 'dairy', 'poultry', 'aquaculture', 'agronomy',
+    'food security', 'rural development', 'agricultural economics', 'sustainable agriculture',
+    'agricultural policy', 'land use', 'agricultural trade', 'food supply', 'agroecology',
+    'agribusiness', 'agricultural technology', 'agricultural finance', 'agricultural investment',
+    'crop rotation', 'soil management', 'pest management', 'agricultural research', 'agricultural extension',
+    'food processing', 'food distribution', 'market access', 'subsistence agriculture', 'commercial agriculture',
+    'agricultural productivity', 'nutrition', 'food aid', 'agricultural innovation', 'climate change and agriculture',
+    'agricultural insurance', 'rural livelihoods', 'agricultural workers', 'agricultural supply chain',
+    'biofortification', 'food policy', 'agricultural sustainability', 'agroforestry'
+}
+
+# Function to build a regex matching any of the words, with the alternation factored into a prefix trie
+# Python's regex engine tries the branches of a flat alternation one by one at each position, while the trie
+# only follows the branches sharing the text's next character. Quantifiers are greedy, so the longest word wins
+def trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(character) + build(child) for character, child in sorted(node.items()) if character]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+# Matcher of all keywords, compiled once at import
+# Longer keywords take precedence, so "food security" is reported instead of the "food" it contains
+KEYWORD_PATTERN = re.compile(trie_pattern(KEYWORDS))
+
+# Function to count the keywords found in a text in a single pass (like the substring search it replaces, keywords also match inside longer words)
+def match_keywords(text):
+    if text is None:
+        return Counter()
+    return Counter(KEYWORD_PATTERN.findall(text.lower()))
+
+def is_related_to_food_or_agriculture(description):
+    if description is None:
+        return False
+    return KEYWORD_PATTERN.search(description.lower()) is not None
+
+# Function to yield the elements of the array under a top-level key of a JSON file one at a time
+# The file is read in chunks and each element is decoded as soon as it is complete, so memory stays
+# bounded by the chunk size and the largest element, whatever the size of the file
+def iter_json_array(file_path, key='data', chunk_size=65536):
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+
+        # Function to read the next chunk, dropping the part of the buffer already decoded
+        def read_more():
+            nonlocal buffer, position
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"Unexpected end of {file_path}")
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        # Function to skip whitespace and the given separators, reading more of the file as needed
+        def skip(separators=''):
+            nonlocal position
+            while True:
+                while position < len(buffer) and (buffer[position].isspace() or buffer[position] in separators):
+                    position += 1
+                if position < len(buffer):
+                    return
+                read_more()
+
+        # Find the opening bracket of the array
+        marker = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        while True:
+            match = marker.search(buffer)
+            if match:
+                position = match.end()
+                break
+            # Keep the tail of the buffer, in case the marker spans two chunks
+            position = max(len(buffer) - len(key) - 64, 0)
+            read_more()
+
+        while True:
+            skip(',')
+            if buffer[position] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element is not complete yet
+                read_more()
+                continue
+            # An element is complete once a separator follows it (a number may continue in the next chunk)
+            following = end
+            while following < len(buffer) and buffer[following].isspace():
+                following += 1
+            if following == len(buffer) or buffer[following] not in ',]':
+                read_more()
+                continue
+            position = end
+            yield element
@@ -1,11 +1,20 @@
 ### DELETE ASSISTANTS AND FILES ###
 
+import os
+import sys
 from openai import OpenAI
 from settings import OPENAI_API_KEY
 
+# Make the shared utils package importable when running from the data_pipelines directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.uploads import UploadRegistry
+
 # Initialize OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Registry of the uploaded files, whose entries are invalidated as the files are deleted
+upload_registry = UploadRegistry(client)
+
 my_assistants = client.beta.assistants.list(
     limit="100"
 )
@@ -16,7 +25,7 @@ for assistant in my_assistants:
     # # Delete all files
     try:
         my_files = client.beta.assistants.files.list(
-            
+            assistant_id=assistant.id
         )
     except Exception as e:
         print("Error fetching files list:", e)
@@ -38,4 +47,21 @@ for assistant in my_assistants:
             assistant_id=assistant.id
         )
     except Exception as e:
-        print(e)
\ No newline at end of file
+        print(e)
+
+# Delete the uploaded files (including the documents kept for reuse by the app and gen_usecases_csv.py)
+try:
+    uploaded_files = client.files.list(
+        purpose='assistants'
+    )
+except Exception as e:
+    print("Error fetching files list:", e)
+    uploaded_files = []
+for file in uploaded_files:
+    print("Deleting uploaded file ID:", file.id)
+    try:
+        client.files.delete(file.id)
+        upload_registry.forget(file.id)
+        print("File deleted successfully.")
+    except Exception as e:
+        print("Error deleting file:", e)
@@ -2,186 +2,236 @@
 
 # Import libraries
 import os
+import sys
 import csv
+import json
 from tqdm import tqdm
 from openai import OpenAI
 from pinecone import Pinecone, ServerlessSpec
+import tiktoken
 import time
 import ast
 from settings import (
     OPENAI_API_KEY,
     PINECONE_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    VECTORDB_SYNC_MODE,
 )
 
+# Make the shared utils package importable when running from the data_pipelines directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import CACHE_DIR, retry, content_hash, read_json, write_json_atomic
+from utils.embedding_cache import EmbeddingCache
+from utils.vector_store import LocalIndex
+
 # Initialize OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
 
 # Initialize Pinecone client
 pc = Pinecone(api_key=PINECONE_API_KEY)
 
-# Delete the index
-print("Deleting the index...")
-pc.delete_index("agrifooddatalab-index")
-
-# Create the index
-print("Creating the index...")
-pc.create_index(
-    name="agrifooddatalab-index",
-    dimension=1536,
-    metric="cosine",
-    spec=ServerlessSpec(
-        cloud='aws', 
-        region='us-west-2'
-    ) 
-) 
+# Local manifest of record id -> hash of the embedded text and metadata currently in the index
+manifest_path = os.path.join(CACHE_DIR, 'vectordb_manifest.json')
+
+# Delete the index (only when rebuilding from scratch)
+if VECTORDB_SYNC_MODE == "rebuild":
+    print("Deleting the index...")
+    if "agrifooddatalab-index" in pc.list_indexes().names():
+        pc.delete_index("agrifooddatalab-index")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+# Create the index if it does not exist yet
+if "agrifooddatalab-index" not in pc.list_indexes().names():
+    print("Creating the index...")
+    pc.create_index(
+        name="agrifooddatalab-index",
+        dimension=1536,
+        metric="cosine",
+        spec=ServerlessSpec(
+            cloud='aws',
+            region='us-west-2'
+        )
+    )
 
 # Connect to the index
 index = pc.Index("agrifooddatalab-index")
 
-# Function to get embeddings
-def get_embedding(text, model="text-embedding-3-small"):
-    try:
-        return client.embeddings.create(input=[text], model=model).data[0].embedding
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
-    
-# Load wb_ag_ext_usecases.csv file
+# Initialize the embedding cache shared with the app
+embedding_cache = EmbeddingCache()
+
+# Tokenizer used by the embedding model, to keep each batch within the token budget
+encoding = tiktoken.get_encoding("cl100k_base")
+
+# Function to get the embeddings of a batch of texts, requesting all uncached texts in a single request
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    def create_embeddings(texts):
+        response = client.embeddings.create(input=texts, model=model)
+        return [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+    return embedding_cache.embed(texts, model, create_embeddings)
+
+# Function to group records into batches of at most batch_size records and max_tokens tokens
+def batch_records(records, batch_size=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_MAX_TOKENS):
+    batch = []
+    batch_tokens = 0
+    for record in records:
+        tokens = len(encoding.encode(record['text']))
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+# Function to embed and upsert records in batches, retrying each batch up to three times and recording it in the manifest
+def upsert_records(records, manifest):
+    upserted = 0
+    start_time = time.time()
+    batches = list(batch_records(records))
+    for batch in tqdm(batches, desc="Embedding and upserting batches..."):
+        try:
+            embeddings = retry(get_embeddings, [record['text'] for record in batch])
+            retry(index.upsert, vectors=[
+                (record['id'], embedding, record['metadata'])
+                for record, embedding in zip(batch, embeddings)
+            ])
+            upserted += len(batch)
+        except Exception as e:
+            print(f"Skipping batch of {len(batch)} records: {e}")
+            continue
+        manifest.update({record['id']: record['hash'] for record in batch})
+        write_json_atomic(manifest_path, manifest)
+    elapsed_time = time.time() - start_time
+    print(f"Upserted {upserted} of {len(records)} records in {elapsed_time:.1f} seconds ({upserted / max(elapsed_time, 1e-9):.1f} records/second)")
+
+# Function to delete the vectors of records that no longer exist in the source files
+def delete_records(ids, manifest, batch_size=1000):
+    for i in tqdm(range(0, len(ids), batch_size), desc="Deleting removed records..."):
+        batch = ids[i:i + batch_size]
+        try:
+            retry(index.delete, ids=batch)
+        except Exception as e:
+            print(f"Skipping deletion of {len(batch)} records: {e}")
+            continue
+        for id in batch:
+            manifest.pop(id, None)
+        write_json_atomic(manifest_path, manifest)
+    print(f"Deleted {len(ids)} removed records")
+
+# Function to export all records to the local index the app searches when VECTOR_BACKEND is "local"
+def export_local_index(records, path):
+    embeddings = []
+    for batch in tqdm(list(batch_records(records)), desc="Exporting the local index..."):
+        embeddings += retry(get_embeddings, [record['text'] for record in batch])
+    LocalIndex.build(
+        path,
+        [record['id'] for record in records],
+        embeddings,
+        [record['metadata'] for record in records]
+    )
+    print(f"Exported {len(records)} records to {path}")
+
+# Function to load the use case records from wb_ag_usecases.csv
+def load_usecases(file_path):
+    records = []
+    with open(file_path, mode='r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for i, entry in enumerate(list(reader)[:50]):
+            records.append({
+                # generate the use case id, starting with U00001
+                'id': "U" + f'{i+1:05}',
+                'text': f"Title: {entry['use_case']}.\nDescription: {entry['description']}",
+                'metadata': {
+                    'title': entry['use_case'],
+                    'description': entry['description'],
+                    'type': 'use case',
+                    'project': entry['project'],
+                    'organization': entry['organization'],
+                    'region': entry['region'],
+                    'country': entry['country'],
+                    'document': ast.literal_eval(entry['document']),
+                    'topic': ast.literal_eval(entry['topic']),
+                    'year': ast.literal_eval(entry['year']),
+                    'contact': ast.literal_eval(entry['contact']),
+                    'project_id': entry['id'],
+                }
+            })
+    return records
+
+# Function to load the learning material records from wb_ag_ext_papers.csv
+def load_papers(file_path):
+    records = []
+    with open(file_path, mode='r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for entry in list(reader)[:25]:
+            records.append({
+                'id': entry['id'],
+                'text': f"Title: {entry['document']}.\nDescription: {entry['abstract']}",
+                'metadata': {
+                    'title': entry['document'],
+                    'description': entry['abstract'],
+                    'type': 'learning',
+                    'date': entry['date'],
+                    'contact': ast.literal_eval(entry['contact']),
+                    'topic': ast.literal_eval(entry['topic']),
+                    'organization': entry['organization'],
+                    'url': entry['url']
+                }
+            })
+    return records
+
+# Function to load the dataset records from wb_ag_datasets.csv
+def load_datasets(file_path):
+    records = []
+    with open(file_path, mode='r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for entry in list(reader)[:25]:
+            records.append({
+                'id': entry['dataset_id'],
+                'text': f"Title: {entry['name']}.\nDescription: {entry['description']}",
+                'metadata': {
+                    'title': entry['name'],
+                    'description': entry['description'],
+                    'type': 'dataset',
+                    'project_id': entry['project_id'],
+                    # Pinecone metadata only supports lists of strings, so keep each file as a JSON string
+                    'file': [json.dumps(file) for file in json.loads(entry['files'])],
+                    'keywords': list(json.loads(entry.get('keywords') or '{}'))
+                }
+            })
+    return records
+
+# Load wb_ag_usecases.csv, wb_ag_ext_papers.csv and wb_ag_datasets.csv files
 dirname = os.getcwd()
-file_path = os.path.join(dirname, 'data/wb_ag_usecases.csv')
-
-with open(file_path, mode='r', encoding='utf-8') as file:
-    reader = csv.DictReader(file)
-    for i, entry in enumerate(tqdm(list(reader)[:50], desc="Processing use case examples...")):
-        # Extracting the text
-        embedding_text = f"Title: {entry['use_case']}.\nDescription: {entry['description']}"
-        # Get the embedding
-        embedding = get_embedding(embedding_text)
-
-        # Try to upsert up to three times with a wait time between retries
-        max_retries = 3
-        wait_time = 5  # wait time in seconds
-
-        # generate the use case id, starting with U00001
-        use_case_id = "U" + f'{i+1:05}'
-                
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Insert the embedding into the index
-                index.upsert([
-                    (
-                        use_case_id, 
-                        embedding, 
-                        {
-                            'title': entry['use_case'],
-                            'description': entry['description'],
-                            'type': 'use case',
-                            'project': entry['project'],
-                            'organization': entry['organization'],
-                            'region': entry['region'],
-                            'country': entry['country'],
-                            'document': ast.literal_eval(entry['document']),
-                            'topic': ast.literal_eval(entry['topic']),
-                            'year': ast.literal_eval(entry['year']),
-                            'contact': ast.literal_eval(entry['contact']),
-                            'project_id': entry['id'],
-                        }
-                    )
-                ])
-                break  # If upsert is successful, break out of the retry loop
-            except Exception as e:
-                print(f"Attempt {attempt} failed: {e}")
-                if attempt < max_retries:
-                    print(f"Waiting for {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                else:
-                    print("Max retries reached. Moving to the next item.")
-             
-# Load wb_ag_ext_papers.csv file       
-file_path = os.path.join(dirname, 'data/wb_ag_ext_papers.csv')
-
-with open(file_path, mode='r', encoding='utf-8') as file:
-    reader = csv.DictReader(file)
-    for entry in tqdm(list(reader)[:25], desc="Processing learning materials..."):
-        # Extracting the text
-        embedding_text = f"Title: {entry['document']}.\nDescription: {entry['abstract']}"
-        # Get the embedding
-        embedding = get_embedding(embedding_text)
-
-        # Try to upsert up to three times with a wait time between retries
-        max_retries = 3
-        wait_time = 5  # wait time in seconds
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Insert the embedding into the index
-                index.upsert([
-                    (
-                        entry['id'], 
-                        embedding, 
-                        {
-                            'title': entry['document'],
-                            'description': entry['abstract'],
-                            'type': 'learning',
-                            'date': entry['date'],
-                            'contact': ast.literal_eval(entry['contact']),
-                            'topic': ast.literal_eval(entry['topic']),
-                            'organization': entry['organization'],
-                            'url': entry['url']
-                        }
-                    )
-                ])
-                break  # If upsert is successful, break out of the retry loop
-            except Exception as e:
-                print(f"Attempt {attempt} failed: {e}")
-                if attempt < max_retries:
-                    print(f"Waiting for {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                else:
-                    print("Max retries reached. Moving to the next item.")
-                    
-# Load wb_ag_ext_datasets.csv file       
-file_path = os.path.join(dirname, 'data/wb_ag_datasets.csv')
-
-with open(file_path, mode='r', encoding='utf-8') as file:
-    reader = csv.DictReader(file)
-    for entry in tqdm(list(reader)[:25], desc="Processing datasets..."):
-        # Extracting the text
-        embedding_text = f"Title: {entry['name']}.\nDescription: {entry['description']}"
-        # Get the embedding
-        embedding = get_embedding(embedding_text)
-
-        # Try to upsert up to three times with a wait time between retries
-        max_retries = 3
-        wait_time = 5  # wait time in seconds
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                # Insert the embedding into the index
-                index.upsert([
-                    (
-                        entry['dataset_id'], 
-                        embedding, 
-                        {
-                            'title': entry['name'],
-                            'description': entry['description'],
-                            'type': 'dataset',
-                            'project_id': entry['project_id'],
-                            'file': ast.literal_eval(entry['file'])
-                        }
-                    )
-                ])
-                break  # If upsert is successful, break out of the retry loop
-            except Exception as e:
-                print(f"Attempt {attempt} failed: {e}")
-                if attempt < max_retries:
-                    print(f"Waiting for {wait_time} seconds before retrying...")
-                    time.sleep(wait_time)
-                else:
-                    print("Max retries reached. Moving to the next item.")
+records = (
+    load_usecases(os.path.join(dirname, 'data/wb_ag_usecases.csv'))
+    + load_papers(os.path.join(dirname, 'data/wb_ag_ext_papers.csv'))
+    + load_datasets(os.path.join(dirname, 'data/wb_ag_datasets.csv'))
+)
+
+# Compare the records against the manifest to find new, changed and removed records
+manifest = read_json(manifest_path, {})
+for record in records:
+    record['hash'] = content_hash({'text': record['text'], 'metadata': record['metadata']})
+changed_records = [record for record in records if manifest.get(record['id']) != record['hash']]
+record_ids = {record['id'] for record in records}
+removed_ids = [id for id in manifest if id not in record_ids]
+print(f"{len(changed_records)} new or changed records, {len(removed_ids)} removed records, {len(records) - len(changed_records)} unchanged records")
+
+# Embed and upsert the new or changed records in batches, and delete the removed ones
+upsert_records(changed_records, manifest)
+delete_records(removed_ids, manifest)
+
+# Export all records to the local index (embeddings come from the embedding cache)
+export_local_index(records, os.path.join(dirname, 'data/local_index'))
+print(f"Embedding cache: {embedding_cache.stats()}")
 
 # Example: Querying the index
 # query_result = index.query(queries=[[0.1, 0.2, ..., 0.128]], top_k=5)
 
 # Remember to delete the index if it is no longer needed
-#pinecone.delete_index(index_name)
\ No newline at end of file
+#pinecone.delete_index(index_name)
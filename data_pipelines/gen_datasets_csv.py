@@ -1,60 +1,35 @@
 ### GENERATE DATASETS CSV FROM WORLD BANK DATASETS API ###
 
-import requests
+import os
+import sys
 from tqdm import tqdm
-import csv
 import json
-import os
-
-def is_related_to_food_or_agriculture(description):
-    keywords = {
-    'food', 'agriculture', 'farming', 'crops', 'livestock', 'harvest', 
-    'horticulture', 'irrigation', 'fertilizer', 'farm', 'ranch', 'grain',
-    'vegetable', 'fruit', 'meat', 'dairy', 'poultry', 'aquaculture', 'agronomy',
-    'food security', 'rural development', 'agricultural economics', 'sustainable agriculture',
-    'agricultural policy', 'land use', 'agricultural trade', 'food supply', 'agroecology',
-    'agribusiness', 'agricultural technology', 'agricultural finance', 'agricultural investment',
-    'crop rotation', 'soil management', 'pest management', 'agricultural research', 'agricultural extension',
-    'food processing', 'food distribution', 'market access', 'subsistence agriculture', 'commercial agriculture',
-    'agricultural productivity', 'nutrition', 'food aid', 'agricultural innovation', 'climate change and agriculture',
-    'agricultural insurance', 'rural livelihoods', 'agricultural workers', 'agricultural supply chain',
-    'biofortification', 'food policy', 'agricultural sustainability', 'agroforestry'
-    }
-
-    if description is None:
-        return False
-
-    description_lower = description.lower()
-    for keyword in keywords:
-        if keyword in description_lower:
-            return True
-
-    return False
+from collections import Counter
+from settings import (HTTP_MAX_WORKERS, HTTP_REQUESTS_PER_SECOND, DATASET_STATUSES, DATASET_EXCLUDED_SOURCES, DATASET_MAX_FAILURES)
 
-dirname = os.getcwd()
-file_path = os.path.join(dirname, 'data/wb_datasets.json')
+# Make the shared utils package importable when running from the data_pipelines directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import CACHE_DIR
+from utils.http import Fetcher
+from utils.disk_cache import DiskCache
+from utils.concurrency import bounded_map
+from utils.sinks import CsvSink
+from dataset_catalog import match_keywords, iter_json_array
 
-with open(file_path, 'r') as file:
-    data = json.load(file)
+# Initialize the concurrent fetcher, and the cache of DatasetView responses keyed by dataset_unique_id
+# (with the failed requests of each dataset under failures:<dataset_unique_id>)
+fetcher = Fetcher(max_workers=HTTP_MAX_WORKERS, requests_per_second=HTTP_REQUESTS_PER_SECOND)
+dataset_cache = DiskCache(os.path.join(CACHE_DIR, 'dataset_views.sqlite'))
 
-datasets = data['data']
 base_url = 'https://datacatalogapi.worldbank.org/ddhxext/DatasetView?dataset_unique_id='
-simplified_datasets = []
 
-for dataset in tqdm(datasets, desc="Processing datasets"):
-    dataset_id = dataset.get('dataset_unique_id')
-    url = base_url + dataset_id
-    response = requests.get(url)
-    response_data = response.json()
+# Function to simplify a DatasetView response into the fields kept in the CSV
+def simplify_dataset(dataset_id, response_data):
     name = response_data.get('name', 'None')
     description = response_data.get('identification', {}).get('description', 'None')
-
-    if not is_related_to_food_or_agriculture(description):
-        continue
-
     project_id = response_data.get('identification', {}).get('wb_project_reference', 'None')
     resources = response_data.get('Resources', 'None')
-    
+
     files = []
     if resources != 'None':
         for resource in resources:
@@ -65,18 +40,116 @@ for dataset in tqdm(datasets, desc="Processing datasets"):
             }
             files.append(file)
 
-    simplified_dataset = {
+    return {
         'name': name,
         'description': description,
         'dataset_id': dataset_id,
         'project_id': project_id,
         'files': json.dumps(files)  # Convert list of files to a JSON string
     }
-    simplified_datasets.append(simplified_dataset)
 
+# Function to get a simplified dataset, fetching it unless the prefilter found it unchanged in the cache
+def get_dataset(candidate):
+    dataset, cached_dataset = candidate
+    if cached_dataset is not None:
+        return cached_dataset
+    dataset_id = dataset.get('dataset_unique_id')
+    try:
+        response_data = fetcher.get_json(base_url + dataset_id)
+    except Exception as e:
+        print(f"Error fetching dataset {dataset_id}: {e}")
+        return None
+    simplified_dataset = simplify_dataset(dataset_id, response_data)
+    dataset_cache.set(dataset_id, {'last_updated_date': dataset.get('last_updated_date'), 'dataset': simplified_dataset})
+    dataset_cache.delete(f"failures:{dataset_id}")
+    return simplified_dataset
+
+# Function to get the number of failed requests of a dataset since its catalog entry was last updated
+def get_failures(dataset):
+    failures = dataset_cache.get(f"failures:{dataset.get('dataset_unique_id')}")
+    if failures and failures['last_updated_date'] == dataset.get('last_updated_date'):
+        return failures['count']
+    return 0
+
+# Function to record a failed request of a dataset, returning its number of failed requests
+def record_failure(dataset):
+    count = get_failures(dataset) + 1
+    dataset_cache.set(f"failures:{dataset.get('dataset_unique_id')}", {'last_updated_date': dataset.get('last_updated_date'), 'count': count})
+    return count
+
+dirname = os.getcwd()
+file_path = os.path.join(dirname, 'data/wb_datasets.json')
+
+# Write the crawl incrementally to a partial CSV, which records the datasets already processed so an interrupted crawl resumes
 output_file_path = os.path.join(dirname, 'data/wb_ag_datasets.csv')
-with open(output_file_path, mode='w', newline='', encoding='utf-8') as output_file:
-    writer = csv.DictWriter(output_file, fieldnames=['name', 'description', 'dataset_id', 'project_id', 'files'])
-    writer.writeheader()
-    for dataset in simplified_datasets:
-        writer.writerow(dataset)
\ No newline at end of file
+partial_file_path = f"{output_file_path}.partial"
+sink = CsvSink(partial_file_path, fieldnames=['name', 'description', 'dataset_id', 'project_id', 'files', 'keywords'], key_field='dataset_id')
+prefilter_counts = Counter()
+related_sources = Counter()
+
+# Function to decide from the catalog fields alone which datasets need a DatasetView request
+# Datasets with an excluded status or source, or that failed too many times, are marked as processed without
+# a request, and datasets not updated since they were cached are passed on with their cached result
+def prefilter_datasets(datasets):
+    for dataset in datasets:
+        dataset_id = dataset.get('dataset_unique_id')
+        if dataset_id in sink.keys:
+            prefilter_counts['resumed'] += 1
+        elif dataset.get('status') not in DATASET_STATUSES or dataset.get('source') in DATASET_EXCLUDED_SOURCES:
+            prefilter_counts['skipped'] += 1
+            sink.append([], key=dataset_id)
+        elif get_failures(dataset) >= DATASET_MAX_FAILURES:
+            prefilter_counts['given_up'] += 1
+            sink.append([], key=dataset_id)
+        else:
+            cached = dataset_cache.get(dataset_id)
+            if cached and cached['last_updated_date'] == dataset.get('last_updated_date'):
+                prefilter_counts['cached'] += 1
+                yield dataset, cached['dataset']
+            else:
+                prefilter_counts['fetched'] += 1
+                yield dataset, None
+
+# Stream the catalog through the pipeline: parse each entry, prefilter it, fetch its DatasetView, and write it
+datasets = iter_json_array(file_path, key='data')
+candidates = prefilter_datasets(datasets)
+for (dataset, _), simplified_dataset in tqdm(bounded_map(get_dataset, candidates, max_workers=HTTP_MAX_WORKERS), desc="Processing datasets"):
+    # Datasets that failed to fetch are not marked as processed, so they are retried on the next run,
+    # unless they failed too many times, in which case they are left out so the crawl can be published
+    if simplified_dataset is None:
+        if record_failure(dataset) >= DATASET_MAX_FAILURES:
+            prefilter_counts['abandoned'] += 1
+            sink.append([], key=dataset.get('dataset_unique_id'))
+        else:
+            prefilter_counts['failed'] += 1
+        continue
+    # Keep the matched keywords and their counts, so related datasets can be scored
+    keywords = match_keywords(simplified_dataset['description'])
+    if keywords:
+        related_sources[dataset.get('source')] += 1
+        sink.append([{**simplified_dataset, 'keywords': json.dumps(keywords)}], key=dataset.get('dataset_unique_id'))
+    else:
+        sink.append([], key=dataset.get('dataset_unique_id'))
+
+# Report how many DatasetView requests the prefilter saved, among the datasets not already processed by an interrupted run
+total = prefilter_counts['fetched'] + prefilter_counts['cached'] + prefilter_counts['skipped'] + prefilter_counts['given_up']
+saved = total - prefilter_counts['fetched']
+print(
+    f"{total} datasets: {prefilter_counts['fetched']} fetched, {prefilter_counts['cached']} unchanged since the last crawl, "
+    f"{prefilter_counts['skipped']} skipped by status or source, {prefilter_counts['given_up']} skipped after failing {DATASET_MAX_FAILURES} times"
+)
+print(f"{saved} of {total} requests saved ({saved / max(total, 1):.0%})")
+if prefilter_counts['resumed']:
+    print(f"{prefilter_counts['resumed']} datasets already processed by the interrupted run")
+# Report the related datasets per source (among the datasets requested or cached), to see which sources produce matches
+print(f"Related datasets by source in this run: {dict(related_sources.most_common())}")
+
+if prefilter_counts['abandoned']:
+    print(f"{prefilter_counts['abandoned']} datasets left out after failing {DATASET_MAX_FAILURES} times")
+
+# Replace the CSV with the completed crawl
+if not prefilter_counts['failed']:
+    os.replace(partial_file_path, output_file_path)
+    os.remove(sink.progress_path)
+else:
+    print(f"{prefilter_counts['failed']} datasets failed, run again to resume the crawl")
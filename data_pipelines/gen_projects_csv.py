@@ -1,8 +1,43 @@
 import os
+import sys
 import pandas as pd
-import requests
-from tqdm import tqdm
-import numpy as np
+from settings import (HTTP_MAX_WORKERS, HTTP_REQUESTS_PER_SECOND)
+
+# Make the shared utils package importable when running from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.http import Fetcher
+
+# Initialize the concurrent fetcher shared by the WB Projects and Documents API requests
+fetcher = Fetcher(max_workers=HTTP_MAX_WORKERS, requests_per_second=HTTP_REQUESTS_PER_SECOND)
+
+# Function to extract the fields of a WB Projects API project into a record
+def parse_project(project):
+    record = {}
+    for key, value in project.items():
+        if key == "regionname":
+            record["region"] = value
+        elif key == "countryname":
+            record["country"] = value[0]
+        elif key == "project_name":
+            record["project"] = value
+        elif key == "team_lead_details":
+            record["contact"] = value[0]
+        elif key == "borrower":
+            record["organization"] = value
+        elif key == "fiscalyear":
+            record["year"] = value
+        elif key == "sector1":
+            record["topic"] = value["Name"]
+    return record
+
+# Function to extract the documents of a WB Documents API response into a {doctype: pdfurl} dictionary
+def parse_documents(response):
+    documents = {}
+    if response:
+        for doc in reversed(response['documents'].values()):
+            if 'docty' in doc and 'pdfurl' in doc:
+                documents[doc['docty']] = doc['pdfurl']
+    return documents
 
 # Function to create wb_ag_projects_df from WB Projects and Documents API
 def create_projects_df(filename):
@@ -10,54 +45,51 @@ def create_projects_df(filename):
     # import csv file as dataframe
     df = pd.read_csv(f'data_pipelines/data/{filename}.csv')
     
+    print("fetching projects from WB Projects API...")
+    projects = fetcher.get_json_all({
+        id: f"https://search.worldbank.org/api/v2/projects?format=json&fl=*&id={id}"
+        for id in df['id'].unique()
+    })
+
+    # Collect the project fields into plain records, keyed by project id
+    # A request that failed (None) says nothing about the project, so it is kept apart from a project missing from the API
+    project_records = {}
+    failed_ids = set()
+    for id, response in projects.items():
+        if response is None:
+            failed_ids.add(id)
+            continue
+        project = response.get('projects', {}).get(id)
+        if project:
+            project_records[id] = parse_project(project)
+    if failed_ids:
+        print(f"{len(failed_ids)} projects could not be fetched, keeping their current fields")
+
     print("filling out df using WB Projects API...")
-    for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-        project = requests.get(f"https://search.worldbank.org/api/v2/projects?format=json&fl=*&id={row['id']}").json()['projects']
-        if len(project) > 0:
-            for key, value in project[row['id']].items():
-                print(key)
-                if key == "regionname":
-                    if 'region' not in df.columns:
-                        df['region'] = np.nan
-                    df.at[index, "region"] = value
-                elif key == "countryname":
-                    if 'country' not in df.columns:
-                        df['country'] = np.nan
-                    df.at[index, "country"] = value[0]
-                elif key == "project_name":
-                    if 'project' not in df.columns:
-                        df['project'] = np.nan
-                    df.at[index, "project"] = value
-                elif key == "team_lead_details":
-                    if 'contact' not in df.columns:
-                        df['contact'] = np.nan
-                    df.at[index, "contact"] = value[0]
-                elif key == "borrower":
-                    if 'organization' not in df.columns:
-                        df['organization'] = np.nan
-                    df.at[index, "organization"] = value
-                elif key == "fiscalyear":
-                    if 'year' not in df.columns:
-                        df['year'] = np.nan
-                    df.at[index, "year"] = value
-                elif key == "sector1":
-                    if 'topic' not in df.columns:
-                        df['topic'] = np.nan
-                    df.at[index, "topic"] = value["Name"]
-        else:
-            df.drop(index, inplace=True)
+    # Drop the projects missing from the API with a single mask (projects whose request failed are kept as they are)
+    df = df[df['id'].isin(project_records.keys() | failed_ids)].copy()
+    # Merge the fields into the frame in one assignment per column (keeping existing values where the API has none)
+    fields_df = pd.DataFrame.from_dict(project_records, orient='index').reindex(df['id'])
+    fields_df.index = df.index
+    for column in fields_df.columns:
+        df[column] = fields_df[column].combine_first(df[column]) if column in df.columns else fields_df[column]
     
+    print("fetching project docs from WB Documents API...")
+    documents = fetcher.get_json_all({
+        id: f"https://search.worldbank.org/api/v2/wds?format=json&fl=pdfurl,docty&proid={id}"
+        for id in df['id'].unique()
+    })
+
     print("adding project docs to df using WB Documents API...")
-    df['document'] = None
-    for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-        df.at[index, 'document'] = {}
-        response = requests.get(f"https://search.worldbank.org/api/v2/wds?format=json&fl=pdfurl,docty&proid={row['id']}").json()
-        if response:
-            for doc in reversed(response['documents'].values()):
-                if 'docty' in doc and 'pdfurl' in doc:
-                    doctype = doc['docty']
-                    pdfurl = doc['pdfurl']
-                    df.at[index, 'document'][doctype] = pdfurl
+    # Keep the current documents of the projects whose request failed
+    project_documents = {id: parse_documents(response) for id, response in documents.items() if response is not None}
+    if len(project_documents) < len(documents):
+        print(f"{len(documents) - len(project_documents)} project docs could not be fetched, keeping their current documents")
+    fetched = df['id'].isin(project_documents.keys())
+    if 'document' in df.columns:
+        df['document'] = df['id'].map(project_documents).where(fetched, df['document'])
+    else:
+        df['document'] = df['id'].map(project_documents)
 
     print("saving df to csv.....")
     df.to_csv(f'data_pipelines/data/{filename}.csv', index=False)
@@ -1,22 +1,42 @@
 import pandas as pd
 from openai import OpenAI
 import json
-import requests
 import os
+import sys
 import ast
 import time
-from settings import (OPENAI_API_KEY)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from settings import (OPENAI_API_KEY, USECASES_MAX_WORKERS, OPENAI_REQUESTS_PER_MINUTE, RUN_TIMEOUT)
+
+# Make the shared utils package importable when running from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.concurrency import RateLimiter
+from utils.sinks import CsvSink
+from utils.runs import wait_on_run
+from utils.downloads import DownloadManager
+from utils.uploads import UploadRegistry
 
 csv_input = 'data_pipelines/data/dddag_projects.csv'
 csv_output = 'data_pipelines/data/dddag_usecases.csv'
 
-# Initialize OpenAI client
+# Initialize OpenAI client (retrying rate-limited requests with backoff)
 client = OpenAI(
     api_key=OPENAI_API_KEY,
+    max_retries=5,
 )
 
+# Rate limiter shared by all workers, so parallel documents stay within the OpenAI request rate
+rate_limiter = RateLimiter(rate=OPENAI_REQUESTS_PER_MINUTE / 60, burst=USECASES_MAX_WORKERS)
+
+# Download manager caching the project documents (shared with the app), so documents are only downloaded once across runs
+download_manager = DownloadManager()
+
+# Registry of the uploaded documents (shared with the app), so a document is only uploaded once across runs
+upload_registry = UploadRegistry(client, before_request=rate_limiter.acquire)
+
 # Function to submit tool outputs
 def submit_tool_outputs(thread_id, run_id, tool_call_id, output):
+    rate_limiter.acquire()
     client.beta.threads.runs.submit_tool_outputs(
         thread_id=thread_id,
         run_id=run_id,
@@ -26,46 +46,11 @@ def submit_tool_outputs(thread_id, run_id, tool_call_id, output):
         }]
     )
 
-# Function to process a document and update the DataFrame
-def process_document(url, id, project, organization, region, country, document, topic, year, contact):
-
-    # Read wb_use_case_summaries.csv into wb_use_case_summaries_df
-    if os.path.exists(csv_output):
-        use_cases_df = pd.read_csv(csv_output)
-    else:
-        use_cases_df = pd.DataFrame(columns=['id', 'use_case', 'project', 'description', 'organization', 'region', 'country', 'document', 'topic', 'year', 'contact'])
-
-    # Download the file
-    response = requests.get(url)
-    file_name = 'downloaded_file.pdf'
-    with open(file_name, 'wb') as file:
-        file.write(response.content)
-
-    # Initialize OpenAI client
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
-    # Upload the file to OpenAI
-    print("Uploading files...")
-    file_path = file_name
-    project_document_file = client.files.create(
-      file=open(file_path, "rb"),
-      purpose='assistants'
-    )
-    
-    # Initialize tools
-    tools = [
-        {
-            "type": "retrieval"
-        }
-    ]
-
-    # Function mapping
-    function_mapping = {
-    }
-    
-    # Create the Assistant
+# Function to create the Assistant shared by all documents of a run
+def create_assistant():
     print("Creating Assistant...")
-    assistant = client.beta.assistants.create(
+    rate_limiter.acquire()
+    return client.beta.assistants.create(
         name="Use Case Summarizer",
         instructions=
             '''
@@ -95,50 +80,60 @@ def process_document(url, id, project, organization, region, country, document,
             ]
             ''',
         model="gpt-4-0125-preview",
-        tools = tools,
-        file_ids=[project_document_file.id]
+        tools=[
+            {
+                "type": "retrieval"
+            }
+        ]
     )
 
-    # Create a thread
-    print("Creating thread...")
-    thread = client.beta.threads.create(
-    )
+# Function to process a document with the shared Assistant and return its use cases
+def process_document(assistant_id, url, *args):
 
-    # Add message to the thread
-    print("Adding message to the thread...")
-    message = client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content= ""
-    )
+    # Download the file (served from the local download cache if it was downloaded before) to a path of its own, since several documents are processed in parallel
+    with download_manager.download(url) as file_name:
+        return process_downloaded_document(assistant_id, file_name, *args)
 
-    # Run the Assistant
-    print("Running the Assistant...")
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id, 
-        assistant_id=assistant.id,
-        instructions=""
-    )
+# Function to extract the use cases of a downloaded document
+def process_downloaded_document(assistant_id, file_name, id, project, organization, region, country, document, topic, year, contact):
 
-    # Handle tool outputs
-    while run.status != 'completed':
-        time.sleep(10)
-        
-        run = client.beta.threads.runs.retrieve(
+    # Function mapping
+    function_mapping = {
+    }
+
+    thread = None
+    try:
+        # Upload the file to OpenAI, reusing the file uploaded by a previous run if there is one
+        print("Uploading files...")
+        project_document_file_id = upload_registry.upload(file_name)
+
+        # Create a thread
+        print("Creating thread...")
+        rate_limiter.acquire()
+        thread = client.beta.threads.create(
+        )
+
+        # Add message to the thread, with the document attached for retrieval
+        print("Adding message to the thread...")
+        rate_limiter.acquire()
+        message = client.beta.threads.messages.create(
             thread_id=thread.id,
-            run_id=run.id
+            role="user",
+            content= "",
+            file_ids=[project_document_file_id]
         )
-        
-        # Print the run status
-        print(f"Run status: {run.status}")
-        
-        # If the run is failed, retry
-        if run.status == "failed":
-            print("Run failed:", run.last_error)
-            break
 
-        # Handle the run status
-        if run.status == "requires_action":
+        # Run the Assistant
+        print("Running the Assistant...")
+        rate_limiter.acquire()
+        run = client.beta.threads.runs.create(
+            thread_id=thread.id, 
+            assistant_id=assistant_id,
+            instructions=""
+        )
+
+        # Function to handle tool outputs
+        def handle_required_action(run):
             print("Action required by the assistant...")
             for tool_call in run.required_action.submit_tool_outputs.tool_calls:
                 if tool_call.type == "function":
@@ -151,94 +146,112 @@ def process_document(url, id, project, organization, region, country, document,
                         response = function_mapping[function_name](**arguments)
                         submit_tool_outputs(thread.id, run.id, tool_call.id, response)
 
-    # Fetch the Assistant's response  
-    print("Fetching Assistant's response...")
-    reply = client.beta.threads.messages.list(
-        thread_id=thread.id
-    )
-    messages = reply.data
-
-    assistant_reply = ""
-    for message in messages:
-        if message.role == "assistant":
-            for content in message.content:
-                if content.type == "text":
-                    assistant_reply = content.text.value
-                    print("assistant_reply: ", assistant_reply, "type: ", type(assistant_reply))
-                    # Find the position of the first '[' and the last ']'
-                    start_index = assistant_reply.find('[')
-                    end_index = assistant_reply.rfind(']')
-
-                    # Extract the substring between these positions
-                    if start_index != -1 and end_index != -1:
-                        json_string = assistant_reply[start_index:end_index+1]
-                        try:
-                            formatted_assistant_reply = json.loads(json_string)
-                            print("formatted_assistant_reply: ", formatted_assistant_reply, "type: ", type(formatted_assistant_reply))
-                        except json.JSONDecodeError as e:
-                            print("Failed to decode JSON. Error: ", e)
-                    else:
-                        print("The string does not contain a valid JSON structure.")
+        # Wait for the run to finish (polling adaptively, and cancelling it after RUN_TIMEOUT seconds)
+        run = wait_on_run(
+            client,
+            thread_id=thread.id,
+            run_id=run.id,
+            timeout=RUN_TIMEOUT,
+            on_requires_action=handle_required_action,
+            on_status=lambda run: print(f"Run status: {run.status}"),
+            before_request=rate_limiter.acquire
+        )
+        # Fail the document unless the run completed, so the project is retried on the next run
+        if run.status != "completed":
+            raise RuntimeError(f"Run {run.status}: {run.last_error}")
+
+        # Fetch the Assistant's response  
+        print("Fetching Assistant's response...")
+        rate_limiter.acquire()
+        reply = client.beta.threads.messages.list(
+            thread_id=thread.id
+        )
+        messages = reply.data
+
+        assistant_reply = ""
+        formatted_assistant_reply = None
+        for message in messages:
+            if message.role == "assistant":
+                for content in message.content:
+                    if content.type == "text":
+                        assistant_reply = content.text.value
+                        print("assistant_reply: ", assistant_reply, "type: ", type(assistant_reply))
+                        # Find the position of the first '[' and the last ']'
+                        start_index = assistant_reply.find('[')
+                        end_index = assistant_reply.rfind(']')
 
+                        # Extract the substring between these positions
+                        if start_index != -1 and end_index != -1:
+                            json_string = assistant_reply[start_index:end_index+1]
+                            try:
+                                formatted_assistant_reply = json.loads(json_string)
+                                print("formatted_assistant_reply: ", formatted_assistant_reply, "type: ", type(formatted_assistant_reply))
+                            except json.JSONDecodeError as e:
+                                print("Failed to decode JSON. Error: ", e)
+                        else:
+                            print("The string does not contain a valid JSON structure.")
+
+                        break
+                if assistant_reply:
                     break
-            if assistant_reply:
-                break
+
+        # Fail the document unless its use cases were parsed, so the project is not marked as processed and is retried on the next run
+        if not isinstance(formatted_assistant_reply, list):
+            raise ValueError("The Assistant's reply does not contain a JSON list of use cases")
     
-    # Process the Assistant's response
-    for use_case in formatted_assistant_reply:
-        
-        print("use case: ", use_case, "type: ", type(use_case))
+        # Process the Assistant's response
+        use_cases = []
+        for use_case in formatted_assistant_reply:
         
-        # Check if the use_case is a string and convert it to a dictionary
-        if isinstance(use_case, str):
-            use_case = ast.literal_eval(use_case)
+            print("use case: ", use_case, "type: ", type(use_case))
         
-        # Add additional fields to the use_case
-        use_case['id'] = id
-        use_case['project'] = project
-        use_case['organization'] = organization
-        use_case['region'] = region
-        use_case['country'] = country
-        use_case['document'] = document
-        use_case['topic'] = topic
-        use_case['year'] = year
-        use_case['contact'] = contact
-
-        # Add new row to DataFrame
-        use_cases_df = pd.concat([use_cases_df, pd.DataFrame([use_case])], ignore_index=True)
-
-        # Write the updated DataFrame to CSV
-        use_cases_df.to_csv(csv_output, index=False)
-
-    # Delete the file locally
-    if os.path.exists(file_name):
-        os.remove(file_name)
-    else:
-        print("The file does not exist")
+            # Check if the use_case is a string and convert it to a dictionary
+            if isinstance(use_case, str):
+                use_case = ast.literal_eval(use_case)
         
-    ## Delete the file object
-    #client.beta.assistants.files.delete(
-    #    file_id=project_document_file.id,
-    #    assistant_id=assistant.id
-    #)
-        
-    ## Delete the assistant
-    #client.beta.assistants.delete(
-    #    assistant_id=assistant.id
-    #)
+            # Add additional fields to the use_case
+            use_case['id'] = id
+            use_case['project'] = project
+            use_case['organization'] = organization
+            use_case['region'] = region
+            use_case['country'] = country
+            use_case['document'] = document
+            use_case['topic'] = topic
+            use_case['year'] = year
+            use_case['contact'] = contact
+
+            use_cases.append(use_case)
+
+        return use_cases
+
+    # Clean up the thread, whether or not the document was processed (uploaded files are kept for reuse, and deleted by delete_all_assistants_and_files.py)
+    finally:
+        if thread is not None:
+            try:
+                rate_limiter.acquire()
+                client.beta.threads.delete(thread.id)
+            except Exception as e:
+                print("Error deleting thread:", e)
+
+# Function to select the document to process for a project, preferring appraisal, paper and completion reports
+def select_document(document):
+    for doctype, url in document.items():
+        if doctype == 'Project Appraisal Document' or doctype == 'Project Paper' or doctype == 'Implementation Completion and Results Report' or doctype == 'Implementation Completion Report Review': 
+            return doctype, url
+        elif doctype == 'Project Information Document':
+            return doctype, url
+    return None, None
 
 # Read wb_ag_projects.csv into wb_ag_projects_df
 projects_df = pd.read_csv(csv_input)
 
-# Read wb_use_case_summaries.csv into wb_use_case_summaries_df
-if os.path.exists(csv_output):
-    use_cases_df = pd.read_csv(csv_output)
-else:
-    use_cases_df = pd.DataFrame(columns=['id', 'use_case', 'project', 'description', 'organization', 'region', 'country', 'document', 'topic', 'year', 'contact'])
+# Open the use cases CSV as an append-only sink, with the ids of the projects already processed
+use_cases_sink = CsvSink(csv_output, fieldnames=['id', 'use_case', 'project', 'description', 'organization', 'region', 'country', 'document', 'topic', 'year', 'contact'], key_field='id')
 
-# iterate through projects df and process each document
+# Select the document to process for each project that has not been processed yet
+tasks = []
 for index, row in projects_df.iterrows():
-    if not use_cases_df['id'].isin([row['id']]).any():
+    if row['id'] not in use_cases_sink.keys:
         # Check if projectdocs is a string and convert it to a dictionary
         if isinstance(row['document'], str):
             try:
@@ -246,16 +259,35 @@ for index, row in projects_df.iterrows():
             except ValueError:
                 # Handle the exception if the string cannot be converted to a dictionary
                 continue
-        for doctype, url in document.items():
-            if doctype == 'Project Appraisal Document' or doctype == 'Project Paper' or doctype == 'Implementation Completion and Results Report' or doctype == 'Implementation Completion Report Review': 
-                print("Processing document: ", doctype, " for project: ", row['id'])
-                process_document(url, row['id'], row['project'], row['organization'], row['region'], row['country'], row['document'], row['topic'], row['year'], row['contact'])
-                #time.sleep(300)
-                break
-            elif doctype == 'Project Information Document':
-                print("Processing document: ", doctype, " for project: ", row['id'])
-                process_document(url, row['id'], row['project'], row['organization'], row['region'], row['country'], row['document'], row['topic'], row['year'], row['contact'])
-                #time.sleep(300)
-                break
-            else:
-                continue
\ No newline at end of file
+        doctype, url = select_document(document)
+        if url:
+            tasks.append((doctype, url, row))
+
+# Process the documents in parallel with a single Assistant, with the main thread as the single writer of the results
+start_time = time.time()
+assistant = create_assistant()
+try:
+    with ThreadPoolExecutor(max_workers=USECASES_MAX_WORKERS) as executor:
+        futures = {}
+        for doctype, url, row in tasks:
+            print("Processing document: ", doctype, " for project: ", row['id'])
+            future = executor.submit(process_document, assistant.id, url, row['id'], row['project'], row['organization'], row['region'], row['country'], row['document'], row['topic'], row['year'], row['contact'])
+            futures[future] = row['id']
+        try:
+            for future in as_completed(futures):
+                try:
+                    use_cases = future.result()
+                except Exception as e:
+                    print(f"Failed to process project {futures[future]}: {e}")
+                    continue
+                # Append the new rows to the CSV and mark the project as processed
+                use_cases_sink.append(use_cases, key=futures[future])
+        except BaseException:
+            # On interruption (e.g. Ctrl-C), cancel the documents not started yet so they are processed when the run resumes,
+            # and only wait for the documents already being processed
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+finally:
+    # Delete the Assistant once the run is over
+    client.beta.assistants.delete(assistant_id=assistant.id)
+print(f"Processed {len(tasks)} documents in {time.time() - start_time:.1f} seconds")
@@ -10,8 +10,45 @@ PINECONE_API_KEY = st.secrets["PINECONE_API_KEY"]
 PINECONE_INDEX = "agrifooddatalab-index"
 PINECONE_ENVIRONMENT = st.secrets["PINECONE_ENVIRONMENT"]
 
+# Number of records embedded and upserted per request, and the token budget of each embeddings request
+EMBEDDING_BATCH_SIZE = 100
+EMBEDDING_BATCH_MAX_TOKENS = 100000
+
+# "incremental" only embeds new or changed records and deletes removed ones, "rebuild" deletes and recreates the index
+VECTORDB_SYNC_MODE = "incremental"
+
+# Number of documents gen_usecases_csv.py processes in parallel, and the OpenAI request rate shared by its workers
+USECASES_MAX_WORKERS = 4
+OPENAI_REQUESTS_PER_MINUTE = 60
+
+# Seconds after which an Assistants run that has not finished is cancelled
+RUN_TIMEOUT = 900
+
+# Number of concurrent HTTP requests to the World Bank APIs, and the request rate allowed per host
+HTTP_MAX_WORKERS = 8
+HTTP_REQUESTS_PER_SECOND = 5
+
+# Catalog statuses and sources of the datasets worth requesting from the DatasetView API (checked before any request)
+# No source is excluded by default: gen_datasets_csv.py prints the related datasets per source, but an excluded source is
+# no longer requested, so its matches can no longer be seen
+DATASET_STATUSES = ['PUBLISHED']
+DATASET_EXCLUDED_SOURCES = []
+
+# Number of failed DatasetView requests after which a dataset is given up on until its catalog entry is updated
+DATASET_MAX_FAILURES = 3
+
 YOUTUBE_API_KEY = st.secrets["YOUTUBE_API_KEY"]
 
+# Number of YouTube transcripts fetched in parallel
+YOUTUBE_MAX_WORKERS = 8
+
+# Target size of the transcript excerpts in tokens, and the number of tokens each excerpt repeats from the previous one
+TRANSCRIPT_CHUNK_TOKENS = 256
+TRANSCRIPT_CHUNK_OVERLAP_TOKENS = 48
+
+# Number of video descriptions summarized in parallel (requests share the OPENAI_REQUESTS_PER_MINUTE rate)
+SUMMARIES_MAX_WORKERS = 4
+
 COHERE_API_KEY = st.secrets["COHERE_API_KEY"]
 
 REGIONS = [
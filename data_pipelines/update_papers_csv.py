@@ -1,9 +1,37 @@
 ### ADD PDF URLS TO wb_ag_ext_projects.csv FILE ###
 
-import requests
 import pandas as pd
 from tqdm import tqdm
 import os
+import sys
+from settings import (HTTP_MAX_WORKERS, HTTP_REQUESTS_PER_SECOND)
+
+# Make the shared utils package importable when running from the data_pipelines directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import CACHE_DIR
+from utils.http import Fetcher
+from utils.disk_cache import DiskCache
+from utils.concurrency import bounded_map
+
+# Initialize the concurrent fetcher, and the cache of report number -> pdfurl ('' when the API has no pdfurl for the report)
+fetcher = Fetcher(max_workers=HTTP_MAX_WORKERS, requests_per_second=HTTP_REQUESTS_PER_SECOND)
+pdfurl_cache = DiskCache(os.path.join(CACHE_DIR, 'paper_pdfurls.sqlite'))
+
+# Function to get the pdfurl of a report number, or None if the request failed (failures are not cached, so they are retried on the next run)
+def resolve_pdfurl(id_value):
+    pdfurl = pdfurl_cache.get(str(id_value))
+    if pdfurl is not None:
+        return pdfurl
+    api_call = f"https://search.worldbank.org/api/v2/wds?fl=pdfurl&repnb={id_value}"
+    response = fetcher.try_get_json(api_call)
+    if response is None:
+        return None
+    try:
+        pdfurl = next(iter(response['documents'].values()))['pdfurl']
+    except (KeyError, StopIteration, AttributeError, TypeError):
+        pdfurl = ''
+    pdfurl_cache.set(str(id_value), pdfurl)
+    return pdfurl
 
 # Load the CSV file
 dirname = os.getcwd()
@@ -12,17 +40,17 @@ file_path = os.path.join(dirname, 'data_pipelines/data/wb_ag_papers.csv')
 print(file_path)
 df = pd.read_csv(file_path)
 
-# Loop through the DataFrame and update the URL column
-for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-    id_value = row['Report No.']
-    api_call = f"https://search.worldbank.org/api/v2/wds?fl=pdfurl&repnb={id_value}"
-    response = requests.get(api_call)
-    try:
-        pdfurl = next(iter(response.json()['documents'].values()))['pdfurl']
-        df.at[index, 'url'] = pdfurl
-    except:
-        # delete row if no pdfurl found
-        df.drop(index, inplace=True)
-    
-    # Save the updated DataFrame to a new CSV file
-    df.to_csv('data_pipelines/data/wb_ag_papers_withurl.csv', index=False)
\ No newline at end of file
+# Resolve the pdfurl of each distinct report number concurrently
+report_numbers = df['Report No.'].drop_duplicates().tolist()
+pdfurls = dict(tqdm(bounded_map(resolve_pdfurl, report_numbers, max_workers=HTTP_MAX_WORKERS), total=len(report_numbers)))
+
+failed = sum(1 for pdfurl in pdfurls.values() if pdfurl is None)
+if failed:
+    print(f"{failed} report numbers could not be resolved, run again to retry them")
+
+# Update the URL column, and delete the rows for which no pdfurl was found
+df['url'] = df['Report No.'].map(pdfurls)
+df = df[df['url'].fillna('') != '']
+
+# Save the updated DataFrame to a new CSV file
+df.to_csv('data_pipelines/data/wb_ag_papers_withurl.csv', index=False)
@@ -1,51 +1,70 @@
 from googleapiclient.discovery import build
-from youtube_transcript_api import YouTubeTranscriptApi
+from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound, VideoUnavailable
 from openai import OpenAI
 import os
+import sys
 from tqdm import tqdm
-from settings import (OPENAI_API_KEY, YOUTUBE_API_KEY)
+from settings import (
+    OPENAI_API_KEY,
+    YOUTUBE_API_KEY,
+    YOUTUBE_MAX_WORKERS,
+    TRANSCRIPT_CHUNK_TOKENS,
+    TRANSCRIPT_CHUNK_OVERLAP_TOKENS,
+    SUMMARIES_MAX_WORKERS,
+    OPENAI_REQUESTS_PER_MINUTE,
+)
 import json
+import tiktoken
+from collections import deque
 
-# Function to get video description
-def get_video_description(video_id):
-    # Build the YouTube API client
-    youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
-    # Try to fetch the caption track list
-    try:
-        response = youtube.captions().list(
-            part='snippet',
-            videoId=video_id
-        ).execute()
-    except Exception as e:
-        print(f"Error fetching caption tracks: {e}")
-        return None
-    # Check if captions are available
-    if not response['items']:
-        print("No captions available for this video.")
-        return None
-    # Try to fetch video details
-    try:
-        response = youtube.videos().list(
-            part='snippet',
-            id=video_id
-        ).execute()
-        # Check if the video exists and has a snippet
-        if not response['items']:
-            print("Video not found.")
-            return None
-        video_details = response['items'][0]['snippet']
-        # Return the description
-        return video_details['description']
-    except Exception as e:
-        print(f"Error occurred: {e}")
-        return None
+# Make the shared utils package importable when running from the data_pipelines directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import CACHE_DIR, content_hash
+from utils.disk_cache import DiskCache
+from utils.concurrency import RateLimiter, bounded_map
+
+# Tokenizer used by the embedding model, to size the transcript excerpts
+encoding = tiktoken.get_encoding("cl100k_base")
+
+# Build the YouTube API client once (it is not thread-safe, so it is only used from the main thread)
+youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+
+# Initialize the OpenAI client shared by the summarization workers, and the rate limiter of their requests
+client = OpenAI(
+    api_key=OPENAI_API_KEY,
+    max_retries=5,
+)
+rate_limiter = RateLimiter(rate=OPENAI_REQUESTS_PER_MINUTE / 60, burst=SUMMARIES_MAX_WORKERS)
+
+# Caches of transcripts and descriptions keyed by video id, so re-runs only process new uploads,
+# and of summaries keyed by description hash, so identical descriptions are only summarized once
+transcript_cache = DiskCache(os.path.join(CACHE_DIR, 'youtube_transcripts.sqlite'))
+description_cache = DiskCache(os.path.join(CACHE_DIR, 'youtube_descriptions.sqlite'))
+summary_cache = DiskCache(os.path.join(CACHE_DIR, 'youtube_summaries.sqlite'))
+
+# Function to get the descriptions of videos, requesting the details of up to 50 videos at a time
+def get_video_descriptions(video_ids):
+    descriptions = {}
+    for i in range(0, len(video_ids), 50):
+        batch = video_ids[i:i + 50]
+        try:
+            response = youtube.videos().list(
+                part='snippet',
+                id=','.join(batch),
+                maxResults=50
+            ).execute()
+        except Exception as e:
+            print(f"Error fetching video details: {e}")
+            continue
+        for item in response['items']:
+            descriptions[item['id']] = item['snippet']['description']
+    return descriptions
 
 # Function to get all video ids from a channel
 def get_all_video_ids(channel_id):
     # Initialize list
     video_ids = []
     # Get the channel's content details
-    youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
     channel_response = youtube.channels().list(
         id=channel_id,
         part='contentDetails'
@@ -73,13 +92,11 @@ def get_all_video_ids(channel_id):
 
 # Function to get summary text
 def get_summary(text):
-    client = OpenAI(
-        api_key=OPENAI_API_KEY,
-    )
     if not isinstance(text, str):
         print("Error: Text must be a string")
         return None
     try:
+        rate_limiter.acquire()
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
@@ -93,16 +110,30 @@ def get_summary(text):
         print("An error occurred:", e)
         return None
 
-# Group transcript entries (~10 words each) into groups of 20 with 20% overlap
-def group_transcript_entries(transcript):
-    grouped_transcripts = []
-    group_size = 20
-    overlap = 4
-    for i in range(0, len(transcript), group_size - overlap):
-        group = transcript[i:i + group_size]
-        group_text = " ".join([entry['text'] for entry in group])
-        grouped_transcripts.append((group[0]['start'], group_text))
-    return grouped_transcripts
+# Group transcript entries into windows of about target_tokens tokens, each starting with the last overlap_tokens tokens of the previous one
+# Entries are kept whole so each window starts at an entry's timestamp, and windows are yielded as they fill up
+# The overlap is shortened when the next entry does not fit with it, so an entry longer than the target is a window of its own
+def group_transcript_entries(transcript, target_tokens=TRANSCRIPT_CHUNK_TOKENS, overlap_tokens=TRANSCRIPT_CHUNK_OVERLAP_TOKENS):
+    assert 0 <= overlap_tokens < target_tokens, "The overlap must be smaller than the target size of the windows"
+    window = deque()
+    window_tokens = 0
+    new_entries = 0
+    for entry in transcript:
+        tokens = len(encoding.encode(entry['text']))
+        if new_entries and window_tokens + tokens > target_tokens:
+            yield (window[0][0]['start'], " ".join([entry['text'] for entry, _ in window]))
+            # Keep the trailing entries that fit in the overlap
+            while window and window_tokens > overlap_tokens:
+                window_tokens -= window.popleft()[1]
+            new_entries = 0
+        # Drop the overlap entries that do not fit with the next entry
+        while not new_entries and window and window_tokens + tokens > target_tokens:
+            window_tokens -= window.popleft()[1]
+        window.append((entry, tokens))
+        window_tokens += tokens
+        new_entries += 1
+    if new_entries:
+        yield (window[0][0]['start'], " ".join([entry['text'] for entry, _ in window]))
 
 # Format grouped transcripts into a list
 def format_transcript_to_list(grouped_transcripts, video_id, summary):
@@ -113,35 +144,12 @@ def format_transcript_to_list(grouped_transcripts, video_id, summary):
                                      "video summary" : summary})
     return formatted_transcript
 
-# Extract transcipt
+# Extract transcipt, as an empty list if the video has no English transcript and None if fetching it failed
 def get_video_transcript(video_id):
-    # Build the YouTube API client
-    youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
-    # Try to fetch the caption track list
-    try:
-        response = youtube.captions().list(
-            part='snippet',
-            videoId=video_id
-        ).execute()
-    except Exception as e:
-        print(f"Error fetching caption tracks: {e}")
-        return None
-    # Check if captions are available
-    if not response['items']:
-        print("No captions available for this video.")
-        return None
-    # Extracting the transcript using the youtube_transcript_api
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
-        # Grouping the transcript entries
-        grouped_transcripts = group_transcript_entries(transcript)
-        # Get video description to summarize
-        video_description = get_video_description(video_id)
-        # Get the summary
-        summary = get_summary(video_description)
-        # Formatting the grouped transcript to dictionary
-        formatted_transcript = format_transcript_to_list(grouped_transcripts, video_id, summary)
-        return formatted_transcript
+        return YouTubeTranscriptApi.get_transcript(video_id, languages=['en'])
+    except (TranscriptsDisabled, NoTranscriptFound, VideoUnavailable):
+        return []
     except Exception as e:
         print(f"Error fetching transcript: {e}")
         return None
@@ -150,12 +158,39 @@ def get_video_transcript(video_id):
 channel_id = 'UCQ6WkI3b0rDQrGB4-Dm4Zxw'
 video_ids = get_all_video_ids(channel_id)
 
+# Fetch the transcripts of the videos not cached yet concurrently (failed fetches are retried on the next run)
+new_video_ids = [id for id in video_ids if id not in transcript_cache]
+for id, transcript in tqdm(bounded_map(get_video_transcript, new_video_ids, max_workers=YOUTUBE_MAX_WORKERS), total=len(new_video_ids), desc="Fetching transcripts"):
+    if transcript is not None:
+        transcript_cache.set(id, transcript)
+
+# Fetch the descriptions of the videos with a transcript and no cached description
+undescribed_video_ids = [id for id in video_ids if transcript_cache.get(id) and id not in description_cache]
+for id, description in get_video_descriptions(undescribed_video_ids).items():
+    description_cache.set(id, description)
+
+# Summarize each distinct description not summarized yet, with concurrent requests under the rate limit
+video_descriptions = {id: description_cache.get(id) for id in video_ids if id in description_cache}
+unsummarized_descriptions = {
+    content_hash(description): description
+    for description in video_descriptions.values()
+    if content_hash(description) not in summary_cache
+}
+summaries = bounded_map(get_summary, unsummarized_descriptions.values(), max_workers=SUMMARIES_MAX_WORKERS)
+for description, summary in tqdm(summaries, total=len(unsummarized_descriptions), desc="Summarizing descriptions"):
+    if summary is not None:
+        summary_cache.set(content_hash(description), summary)
+print(f"Summarized {len(unsummarized_descriptions)} new distinct descriptions of {len(video_descriptions)} videos")
+
 # generate the transcripts list
 transcripts_list = []
-for id in tqdm(video_ids):
-    transcript_list = get_video_transcript(id)
-    if transcript_list:
-        transcripts_list += transcript_list
+for id in video_ids:
+    transcript = transcript_cache.get(id)
+    if transcript:
+        # Grouping the transcript entries and formatting them to dictionaries
+        grouped_transcripts = group_transcript_entries(transcript)
+        summary = summary_cache.get(content_hash(video_descriptions[id])) if id in video_descriptions else None
+        transcripts_list += format_transcript_to_list(grouped_transcripts, id, summary)
 
 # Saving the list to a new JSON file
 dirname = os.getcwd()
@@ -10,6 +10,21 @@ PINECONE_API_KEY = st.secrets["PINECONE_API_KEY"]
 PINECONE_INDEX = "agrifooddatalab-index"
 PINECONE_ENVIRONMENT = st.secrets["PINECONE_ENVIRONMENT"]
 
+# "pinecone" queries the Pinecone index, "local" searches the local index exported by data_pipelines/gen_and_fill_vectordb.py
+VECTOR_BACKEND = "pinecone"
+LOCAL_INDEX_PATH = "data_pipelines/data/local_index"
+
+# Size and time-to-live (in seconds) of the per-process cache of record metadata
+RECORD_CACHE_SIZE = 1024
+RECORD_CACHE_TTL = 3600
+
+# Optional pacing (in seconds) of pre-computed chat responses, per word and per line (0 renders them immediately)
+RESPONSE_WORD_DELAY = 0
+RESPONSE_LINE_DELAY = 0
+
+# Show (and log) how long each rerun of the app took, to measure the per-interaction overhead
+SHOW_RERUN_TIME = False
+
 YOUTUBE_API_KEY = st.secrets["YOUTUBE_API_KEY"]
 
 COHERE_API_KEY = st.secrets["COHERE_API_KEY"]
@@ -0,0 +1,43 @@
+### CONCURRENCY HELPERS SHARED BY THE APP AND THE DATA PIPELINES ###
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+# Thread-safe token bucket allowing on average rate calls per second, with bursts of up to burst calls
+class RateLimiter:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function to block until a call is allowed
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+# Function to apply func to the items of an iterable on max_workers threads, yielding (item, result) pairs as they complete
+# At most max_in_flight items are submitted at a time, so the iterable is consumed lazily with bounded memory
+def bounded_map(func, iterable, max_workers=8, max_in_flight=None):
+    max_in_flight = max_in_flight or max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for item in iterable:
+            futures[executor.submit(func, item)] = item
+            if len(futures) >= max_in_flight:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield futures.pop(future), future.result()
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,39 @@
+### PERSISTENT KEY-VALUE CACHE OF JSON VALUES FOR THE APP AND THE DATA PIPELINES ###
+
+import os
+import json
+import sqlite3
+import threading
+
+# Thread-safe on-disk dictionary of JSON-serializable values, stored in SQLite
+class DiskCache:
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+    # Function to get the value of a key, or default if it is not cached
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    # Function to set the value of a key
+    def set(self, key, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.connection.commit()
+
+    # Function to remove a key from the cache
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone() is not None
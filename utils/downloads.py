@@ -0,0 +1,95 @@
+### STREAMING FILE DOWNLOADS WITH A LOCAL CONTENT-ADDRESSED CACHE ###
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse, unquote
+from utils.utils import CACHE_DIR
+from utils.http import create_session
+from utils.disk_cache import DiskCache
+
+# Download manager storing each file once under the hash of its content, with an index of URL -> hash and validators
+class DownloadManager:
+
+    def __init__(self, path=os.path.join(CACHE_DIR, 'downloads'), max_age=86400, chunk_size=1024 * 1024, session=None):
+        self.blobs_path = os.path.join(path, 'blobs')
+        os.makedirs(self.blobs_path, exist_ok=True)
+        self.index = DiskCache(os.path.join(path, 'index.sqlite'))
+        # Seconds during which a cached file is served without revalidating it with the server
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self.session = session or create_session()
+        self.url_locks = {}
+        self.lock = threading.Lock()
+
+    # Function to get the lock of a URL, so concurrent callers wait for a single download of the same file
+    def url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    # Function to get the path of the cached file with a content hash
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_path, sha256)
+
+    # Function to get the path of the cached copy of a URL, downloading it if it is not cached or has changed
+    def fetch(self, url, timeout=60):
+        with self.url_lock(url):
+            entry = self.index.get(url)
+            if entry and not os.path.exists(self.blob_path(entry['sha256'])):
+                entry = None
+            if entry and time.time() - entry['checked_at'] < self.max_age:
+                return self.blob_path(entry['sha256'])
+
+            # Revalidate the cached copy with a conditional GET
+            headers = {}
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            with self.session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if entry and response.status_code == 304:
+                    self.index.set(url, {**entry, 'checked_at': time.time()})
+                    return self.blob_path(entry['sha256'])
+                response.raise_for_status()
+
+                # Stream the body to a temporary file in chunks, hashing it on the way
+                sha256 = hashlib.sha256()
+                with tempfile.NamedTemporaryFile(dir=self.blobs_path, suffix='.tmp', delete=False) as file:
+                    try:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            sha256.update(chunk)
+                            file.write(chunk)
+                    except BaseException:
+                        file.close()
+                        os.remove(file.name)
+                        raise
+                os.replace(file.name, self.blob_path(sha256.hexdigest()))
+
+            self.index.set(url, {
+                'sha256': sha256.hexdigest(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'checked_at': time.time(),
+            })
+            return self.blob_path(sha256.hexdigest())
+
+    # Context manager giving the caller a private copy of a URL's file, named after the URL and removed on exit
+    @contextmanager
+    def download(self, url, timeout=60):
+        blob_path = self.fetch(url, timeout=timeout)
+        directory = tempfile.mkdtemp()
+        file_name = os.path.basename(unquote(urlparse(url).path)) or 'downloaded_file'
+        path = os.path.join(directory, file_name)
+        try:
+            # Hard link the cached file when possible, and copy it otherwise
+            try:
+                os.link(blob_path, path)
+            except OSError:
+                shutil.copyfile(blob_path, path)
+            yield path
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
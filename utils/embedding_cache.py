@@ -0,0 +1,104 @@
+### PERSISTENT EMBEDDING CACHE SHARED BY THE APP AND THE DATA PIPELINES ###
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from utils.utils import CACHE_DIR
+
+# Function to normalize text before hashing, so texts differing only in whitespace share a cache entry
+def normalize_text(text):
+    return " ".join(text.split())
+
+# Size-bounded embedding cache keyed by (model, normalized text hash), stored as float32 blobs in SQLite
+class EmbeddingCache:
+
+    def __init__(self, path=os.path.join(CACHE_DIR, 'embeddings.sqlite'), max_entries=100000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Streamlit and the pipelines call the cache from several threads, so share one connection behind a lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, "
+            "text_hash TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+
+    # Function to get the cache key of a text
+    def key(self, text):
+        return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+    # Function to get the cached embeddings of texts, with None for texts that are not cached
+    def get_many(self, texts, model):
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self.lock:
+            # Query in chunks to stay below SQLite's limit on the number of parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.connection.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model, *chunk]
+                ).fetchall()
+                found.update({text_hash: np.frombuffer(embedding, dtype=np.float32).tolist() for text_hash, embedding in rows})
+            self.connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(time.time(), model, key) for key in found]
+            )
+            self.connection.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return [found.get(key) for key in keys]
+
+    # Function to add embeddings to the cache, evicting the least recently used entries beyond max_entries
+    def put_many(self, texts, embeddings, model):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (model, self.key(text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                    for text, embedding in zip(texts, embeddings)
+                ]
+            )
+            count = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self.connection.commit()
+
+    # Function to get the embeddings of texts, calling embed_function once for all distinct uncached texts
+    def embed(self, texts, model, embed_function):
+        embeddings = self.get_many(texts, model)
+        missing = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                missing.setdefault(self.key(text), text)
+        if missing:
+            missing_embeddings = embed_function(list(missing.values()))
+            self.put_many(list(missing.values()), missing_embeddings, model)
+            computed = dict(zip(missing, missing_embeddings))
+            embeddings = [computed[self.key(text)] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return embeddings
+
+    # Function to get the hit/miss counters of the cache
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
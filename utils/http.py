@@ -0,0 +1,64 @@
+### POOLED, RATE-LIMITED CONCURRENT HTTP FETCHING FOR THE DATA PIPELINES ###
+
+import threading
+import requests
+from tqdm import tqdm
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from utils.concurrency import RateLimiter
+
+# Function to create a session with a pool of pool_size connections per host, retrying failed requests with exponential backoff
+def create_session(pool_size=10, retries=5, backoff_factor=1):
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET', 'HEAD'],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Concurrent JSON fetcher sharing one pooled session, with at most max_workers requests in flight and a rate limit per host
+class Fetcher:
+
+    def __init__(self, max_workers=8, requests_per_second=5, session=None):
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.session = session or create_session(pool_size=max_workers)
+        self.rate_limiters = {}
+        self.lock = threading.Lock()
+
+    # Function to get the rate limiter of the host of a URL
+    def rate_limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.rate_limiters:
+                self.rate_limiters[host] = RateLimiter(rate=self.requests_per_second, burst=self.max_workers)
+            return self.rate_limiters[host]
+
+    # Function to get a URL and return its JSON response
+    def get_json(self, url, timeout=60):
+        self.rate_limiter(url).acquire()
+        response = self.session.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    # Function to get a URL and return its JSON response, or None if the request failed
+    def try_get_json(self, url):
+        try:
+            return self.get_json(url)
+        except Exception as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+
+    # Function to get the JSON responses of a dictionary of URLs concurrently, returning a dictionary with the same keys
+    def get_json_all(self, urls, desc=None):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = tqdm(executor.map(self.try_get_json, urls.values()), total=len(urls), desc=desc)
+            return dict(zip(urls.keys(), responses))
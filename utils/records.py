@@ -0,0 +1,61 @@
+### CACHE-AWARE RECORD FETCH LAYER OVER THE KNOWLEDGE BASE INDEX ###
+
+import ast
+import threading
+from cachetools import TTLCache
+
+# Function to parse a 'document' entry ("'name': 'url'" string) into a dictionary, or None if it cannot be parsed
+def parse_document(doc):
+    # Some document names span several lines, which is not a valid string literal, so retry with the whitespace collapsed
+    for text in (doc, ' '.join(doc.split())):
+        try:
+            document = ast.literal_eval('{' + text + '}')
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(document, dict):
+            return document
+    return None
+
+# Function to parse the metadata of a record once, turning the 'document' entries into a dictionary (skipping unparsable entries)
+def parse_metadata(metadata):
+    metadata = dict(metadata)
+    documents = {}
+    for doc in metadata.get('document', []):
+        document = parse_document(doc)
+        if document is None:
+            print(f"Unable to parse document entry: {doc!r}")
+            continue
+        documents.update(document)
+    metadata['documents'] = documents
+    return metadata
+
+# Per-process LRU cache (with a time-to-live) of parsed record metadata, filled from batched index fetches
+class RecordStore:
+
+    def __init__(self, index, maxsize=1024, ttl=3600):
+        self.index = index
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    # Function to add the metadata of records already retrieved elsewhere (e.g. the top k matches of a search)
+    def add_many(self, metadatas):
+        parsed = {id: parse_metadata(metadata) for id, metadata in metadatas.items()}
+        with self.lock:
+            self.cache.update(parsed)
+
+    # Function to get the parsed metadata of records, fetching all uncached ids in a single request
+    def get_many(self, ids):
+        with self.lock:
+            records = {id: self.cache[id] for id in ids if id in self.cache}
+        missing_ids = [id for id in dict.fromkeys(ids) if id not in records]
+        if missing_ids:
+            vectors = self.index.fetch(ids=missing_ids).vectors
+            fetched = {id: parse_metadata(vector.metadata) for id, vector in vectors.items()}
+            with self.lock:
+                self.cache.update(fetched)
+            records.update(fetched)
+        return records
+
+    # Function to get the parsed metadata of a record, or None if it does not exist
+    def get(self, id):
+        return self.get_many([id]).get(id)
@@ -0,0 +1,64 @@
+### SHARED WAITER FOR OPENAI ASSISTANTS RUNS ###
+
+import time
+import random
+
+# Run statuses after which a run never changes again
+TERMINAL_STATUSES = {'completed', 'failed', 'cancelled', 'expired'}
+
+# Error raised when a run does not finish before its deadline
+class RunTimeoutError(TimeoutError):
+    pass
+
+# Function to get the ids of the tool calls a run requires action on
+def required_action_ids(run):
+    if run.status != 'requires_action' or not run.required_action:
+        return frozenset()
+    return frozenset(tool_call.id for tool_call in run.required_action.submit_tool_outputs.tool_calls)
+
+# Function to poll a run and yield it every time its status (or the action it requires) changes, until it finishes or requires a new action
+# Polling starts short and backs off exponentially (with jitter) while the status does not change
+# Required actions in handled_actions (sets of tool call ids) were already handled, so polling goes on until the server moves the run on
+# The last run yielded is always the last one retrieved, so the caller handles the action the run requires now
+def poll_run(client, thread_id, run_id, deadline, initial_interval=0.5, max_interval=10, backoff=1.5, jitter=0.1, before_request=None, handled_actions=()):
+    interval = initial_interval
+    state = None
+    while True:
+        if before_request:
+            before_request()
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        if (run.status, required_action_ids(run)) != state:
+            state = (run.status, required_action_ids(run))
+            interval = initial_interval
+            yield run
+        if run.status in TERMINAL_STATUSES:
+            return
+        if run.status == 'requires_action' and required_action_ids(run) not in handled_actions:
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RunTimeoutError(f"Run {run_id} did not finish before its deadline (last status: {run.status})")
+        time.sleep(min(interval * random.uniform(1 - jitter, 1 + jitter), remaining))
+        interval = min(interval * backoff, max_interval)
+
+# Function to wait for a run to finish, handling required actions, and cancelling it on timeout or interruption
+def wait_on_run(client, thread_id, run_id, timeout=600, on_requires_action=None, on_status=None, before_request=None, **poll_options):
+    deadline = time.monotonic() + timeout
+    handled_actions = set()
+    try:
+        while True:
+            for run in poll_run(client, thread_id, run_id, deadline, before_request=before_request, handled_actions=handled_actions, **poll_options):
+                if on_status:
+                    on_status(run)
+            # Hand required actions to the caller once each, then resume polling (without a handler, return the run as is)
+            if run.status == 'requires_action' and on_requires_action:
+                on_requires_action(run)
+                handled_actions.add(required_action_ids(run))
+                continue
+            return run
+    except (RunTimeoutError, KeyboardInterrupt):
+        try:
+            client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except Exception as e:
+            print(f"Error cancelling run: {e}")
+        raise
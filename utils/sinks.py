@@ -0,0 +1,84 @@
+### APPEND-ONLY, CRASH-SAFE CSV SINK FOR THE DATA PIPELINES ###
+
+import os
+import io
+import csv
+import json
+
+# CSV file that rows are only ever appended to, with an append-only progress log of the committed size and processed keys
+class CsvSink:
+
+    def __init__(self, path, fieldnames, key_field=None):
+        self.path = path
+        self.fieldnames = fieldnames
+        # Column holding the key of each row, used to rebuild the processed keys from the CSV (the first column by default)
+        self.key_field = key_field or fieldnames[0]
+        self.progress_path = f"{path}.progress.jsonl"
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size:
+            # Append in the column order of the existing CSV, which must have the same columns
+            with open(path, mode='r', newline='', encoding='utf-8') as file:
+                header = next(csv.reader(file), [])
+            if set(header) != set(fieldnames):
+                raise ValueError(f"The columns of {path} ({', '.join(header)}) do not match the fieldnames ({', '.join(fieldnames)})")
+            self.fieldnames = header
+        commits = self.read_progress()
+        if not commits or commits[-1]['size'] > size:
+            # No (or a stale) progress log: trust the CSV as written and rebuild the processed keys from its key column
+            self.size = size
+            self.keys = set()
+            if size:
+                with open(path, mode='r', newline='', encoding='utf-8') as file:
+                    self.keys = {row[self.key_field] for row in csv.DictReader(file)}
+        else:
+            # Drop anything written after the last commit (e.g. a row cut short by an interruption)
+            self.size = commits[-1]['size']
+            self.keys = {commit['key'] for commit in commits if commit['key'] is not None}
+            if size > self.size:
+                with open(path, mode='r+b') as file:
+                    file.truncate(self.size)
+        self.compact_progress()
+        if not self.size:
+            self.append([dict(zip(fieldnames, fieldnames))])
+
+    # Function to read the commits of the progress log, ignoring a last line cut short by an interruption
+    def read_progress(self):
+        commits = []
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, mode='r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        commits.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        return commits
+
+    # Function to rewrite the progress log with one commit per processed key (dropping a line cut short by an interruption)
+    def compact_progress(self):
+        tmp_path = f"{self.progress_path}.tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as file:
+            for key in [None, *self.keys]:
+                file.write(json.dumps({'size': self.size, 'key': key}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.progress_path)
+
+    # Function to append rows (as a single write) and commit them, marking key as processed
+    def append(self, rows, key=None):
+        buffer = io.StringIO()
+        # Use the line endings of the CSVs written by pandas, so appended rows match the existing files
+        writer = csv.DictWriter(buffer, fieldnames=self.fieldnames, extrasaction='ignore', lineterminator='\n')
+        writer.writerows(rows)
+        data = buffer.getvalue().encode('utf-8')
+        if data:
+            with open(self.path, mode='ab') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            self.size += len(data)
+        if key is not None:
+            self.keys.add(key)
+        with open(self.progress_path, mode='a', encoding='utf-8') as file:
+            file.write(json.dumps({'size': self.size, 'key': key}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,59 @@
+### REGISTRY OF FILES UPLOADED TO OPENAI, TO REUSE THEM INSTEAD OF UPLOADING THE SAME CONTENT AGAIN ###
+
+import os
+import hashlib
+import threading
+import openai
+from utils.utils import CACHE_DIR
+from utils.disk_cache import DiskCache
+
+# Function to get the SHA-256 hash of a file's content, reading it in chunks
+def file_hash(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# Persistent mapping of (purpose, content hash) -> OpenAI file id, with the reverse mapping to invalidate deleted files
+class UploadRegistry:
+
+    def __init__(self, client, path=os.path.join(CACHE_DIR, 'uploads.sqlite'), before_request=None):
+        self.client = client
+        self.cache = DiskCache(path)
+        # Called before each OpenAI request, e.g. to acquire a rate limiter
+        self.before_request = before_request or (lambda: None)
+        self.key_locks = {}
+        self.lock = threading.Lock()
+
+    # Function to get the lock of a registry key, so concurrent uploads of the same content wait for a single upload
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    # Function to get the id of an uploaded file with the content of a local file, uploading it only if it was not uploaded before
+    def upload(self, path, purpose='assistants'):
+        key = f"{purpose}:{file_hash(path)}"
+        with self.key_lock(key):
+            file_id = self.cache.get(key)
+            if file_id is not None:
+                # Check the file still exists, since it may have been deleted outside of the registry
+                try:
+                    self.before_request()
+                    self.client.files.retrieve(file_id)
+                    return file_id
+                except openai.NotFoundError:
+                    self.forget(file_id)
+            self.before_request()
+            with open(path, 'rb') as file:
+                file_id = self.client.files.create(file=file, purpose=purpose).id
+            self.cache.set(key, file_id)
+            self.cache.set(f"file:{file_id}", key)
+            return file_id
+
+    # Function to remove a deleted file from the registry
+    def forget(self, file_id):
+        key = self.cache.get(f"file:{file_id}")
+        if key is not None:
+            self.cache.delete(key)
+        self.cache.delete(f"file:{file_id}")
@@ -0,0 +1,44 @@
+import os
+import json
+import time
+import hashlib
+
+# Repository root and local cache directory, resolved independently of the working directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(ROOT_DIR, '.cache')
+
+# Function to call a function and retry it up to max_retries times, waiting (with optional backoff) between retries
+def retry(func, *args, max_retries=3, wait_time=5, backoff=1, **kwargs):
+    for attempt in range(1, max_retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            print(f"Attempt {attempt} failed: {e}")
+            if attempt < max_retries:
+                print(f"Waiting for {wait_time} seconds before retrying...")
+                time.sleep(wait_time)
+                wait_time *= backoff
+            else:
+                print("Max retries reached.")
+                raise
+
+# Function to get a stable hash of any JSON-serializable object
+def content_hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# Function to load a JSON file, returning the default if it does not exist
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+# Function to write a JSON file atomically, so an interruption never leaves a partially written file
+def write_json_atomic(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(obj, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,128 @@
+### LOCAL IN-PROCESS VECTOR INDEX, A DROP-IN ALTERNATIVE TO THE PINECONE INDEX ###
+
+import os
+import numpy as np
+import pandas as pd
+
+# Dictionary that also allows attribute access, to mirror the Pinecone response objects
+class Record(dict):
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+# Function to convert a metadata value read from the columnar store back to plain Python
+def to_python(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+# Metadata fields whose posting lists are built when the index is loaded (other fields are indexed on first use)
+FACET_FIELDS = ['type', 'year', 'country', 'region', 'organization', 'topic']
+
+# Cosine similarity index over a memory-mapped embedding matrix, with metadata kept in a Parquet file
+class LocalIndex:
+
+    def __init__(self, path):
+        # Embeddings are stored L2-normalized, so cosine similarity is a single matrix-vector product
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        metadata_df = pd.read_parquet(os.path.join(path, 'metadata.parquet'))
+        self.ids = metadata_df.pop('id').tolist()
+        self.positions = {id: i for i, id in enumerate(self.ids)}
+        self.metadata = {column: [to_python(value) for value in metadata_df[column]] for column in metadata_df.columns}
+        # Posting lists per facet value, stored as boolean bitmaps over the record positions
+        self.postings = {}
+        for field in FACET_FIELDS:
+            self.get_postings(field)
+
+    # Function to write the embeddings and metadata of records to a local index directory
+    @staticmethod
+    def build(path, ids, embeddings, metadatas):
+        os.makedirs(path, exist_ok=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+        metadata_df = pd.DataFrame([{'id': id, **metadata} for id, metadata in zip(ids, metadatas)])
+        # Write to temporary files first, so a running app never loads a half-written index
+        with open(os.path.join(path, 'embeddings.npy.tmp'), 'wb') as file:
+            np.save(file, embeddings)
+        metadata_df.to_parquet(os.path.join(path, 'metadata.parquet.tmp'), index=False)
+        os.replace(os.path.join(path, 'embeddings.npy.tmp'), os.path.join(path, 'embeddings.npy'))
+        os.replace(os.path.join(path, 'metadata.parquet.tmp'), os.path.join(path, 'metadata.parquet'))
+
+    # Function to get the metadata of the record at a position
+    def get_metadata(self, position):
+        return {column: values[position] for column, values in self.metadata.items() if values[position] is not None}
+
+    # Function to get the bitmap of records having each value of a metadata field (list values count for each element)
+    def get_postings(self, field):
+        if field not in self.postings:
+            postings = {}
+            for position, value in enumerate(self.metadata.get(field, [])):
+                for item in (value if isinstance(value, list) else [value]):
+                    if item is None:
+                        continue
+                    if item not in postings:
+                        postings[item] = np.zeros(len(self.ids), dtype=bool)
+                    postings[item][position] = True
+            self.postings[field] = postings
+        return self.postings[field]
+
+    # Function to get the bitmap of records matching a Pinecone-style filter ({field: {"$in": [...]}} or {field: {"$eq": value}})
+    def filter_mask(self, filter):
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, condition in filter.items():
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator == "$in":
+                    values = operand
+                elif operator == "$eq":
+                    values = [operand]
+                else:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                postings = self.get_postings(field)
+                field_mask = np.zeros(len(self.ids), dtype=bool)
+                for value in values:
+                    if value in postings:
+                        field_mask |= postings[value]
+                mask &= field_mask
+        return mask
+
+    # Function to get the top k records most similar to a vector, optionally among the records matching a filter
+    def query(self, vector, top_k=10, include_metadata=False, include_values=False, filter=None):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        # Narrow the candidates with the posting lists before scoring, so only matching rows are read
+        if filter:
+            candidates = np.flatnonzero(self.filter_mask(filter))
+            scores = self.embeddings[candidates] @ vector
+        else:
+            candidates = None
+            scores = self.embeddings @ vector
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k] if top_k else []
+        best = sorted(best, key=lambda i: -scores[i])
+        matches = []
+        for i in best:
+            position = candidates[i] if candidates is not None else i
+            match = Record(id=self.ids[position], score=float(scores[i]))
+            if include_values:
+                match['values'] = self.embeddings[position].tolist()
+            if include_metadata:
+                match['metadata'] = self.get_metadata(position)
+            matches.append(match)
+        return Record(matches=matches)
+
+    # Function to get records by id
+    def fetch(self, ids):
+        vectors = {}
+        for id in ids:
+            if id in self.positions:
+                position = self.positions[id]
+                vectors[id] = Record(id=id, values=self.embeddings[position].tolist(), metadata=self.get_metadata(position))
+        return Record(vectors=vectors)